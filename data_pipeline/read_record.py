@@ -1,15 +1,253 @@
 import os
+import json
 
 import tensorflow as tf
 from data_pipeline import tf_augmentations
 
-def read_and_decode(filename_queue=[], is_training=False,
+def get_record_paths(TFR_DIR, name):
+    '''Returns the TF Record shards of a split
+    Args:
+        TFR_DIR: 'String' that points to the experiment
+            directory with the TF Records
+        name: 'String' name of the split, one of
+            'train', 'val' or 'test'
+    Returns:
+        'List' of shard paths and the 'Integer' number
+        of examples in the split (None if there is
+        no manifest)
+    '''
+    manifest_path = os.path.join(
+        TFR_DIR,
+        'manifest.json')
+
+    if not os.path.exists(manifest_path):
+        return [os.path.join(TFR_DIR, name + '.tfrecords')], None
+
+    with open(manifest_path, 'r') as handle:
+        manifest = json.load(handle)[name]
+
+    record_paths = [
+        os.path.join(TFR_DIR, shard['path'])
+        for shard in manifest['shards']]
+
+    return record_paths, manifest['num_examples']
+
+
+def get_record_format(TFR_DIR):
+    '''Returns how the TF Records of an experiment
+    are encoded
+    Args:
+        TFR_DIR: 'String' that points to the experiment
+            directory with the TF Records
+    Returns:
+        'Dict' with the compression_type, frame_encoding
+        and meta_format keyword arguments of
+        :read_and_decode. Records without a manifest are
+        uncompressed raw frames with file name meta
+    '''
+    manifest_path = os.path.join(
+        TFR_DIR,
+        'manifest.json')
+
+    record_format = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as handle:
+            record_format = json.load(handle).get(
+                'format', {})
+
+    return {
+        'compression_type': record_format.get(
+            'compression_type', ''),
+        'frame_encoding': record_format.get(
+            'frame_encoding', 'raw'),
+        'meta_format': record_format.get(
+            'meta_format', 'names')}
+
+
+def load_meta_index(TFR_DIR):
+    '''Loads the side-car index of compact meta
+    Args:
+        TFR_DIR: 'String' that points to the experiment
+            directory with the TF Records
+    Returns:
+        'Dict' with cell ids as keys and 'List' of
+        frame paths as values
+    '''
+    with open(os.path.join(TFR_DIR, 'meta_index.json'), 'r') as handle:
+        meta_index = json.load(handle)
+
+    return {
+        int(cell_id): frames
+        for cell_id, frames in meta_index.items()}
+
+
+def get_meta_file_names(meta_index, meta, window):
+    '''Maps compact meta back to the file names of
+    an example
+    Args:
+        meta_index: 'Dict' returned by :load_meta_index
+        meta: (cell_id, start_frame_index) pair of an
+            example
+        window: 'Integer' number of frames per example
+    Returns:
+        'List' of frame paths of the example
+    '''
+    cell_id, start_index = int(meta[0]), int(meta[1])
+
+    return meta_index[cell_id][start_index : start_index + window]
+
+
+def decode_frames(parsed, height=100, width=100,
+                    n_intermediate_frames=3,
+                    frame_encoding='raw'):
+    '''Decodes the frames of a batch of parsed examples
+    Args:
+        parsed: 'Dict' of parsed features
+        height: 'Integer' to specify the target height of
+            each frame
+        width: 'Interger' to specify the target width of
+            each frame
+        n_intermediate_frames: 'Interger' to mention the
+            number of intermediate frames
+        frame_encoding: 'String' one of 'raw' or 'png'
+    Returns:
+        'Tensors' of dtype tf.uint8 containing batches of
+        first, last and intermediate frames
+    '''
+    if frame_encoding == 'png':
+        # tf.image.decode_png is not batched
+        def __decode_png(frames):
+            return tf.map_fn(
+                lambda frame: tf.image.decode_png(
+                    frame,
+                    channels=1),
+                frames,
+                dtype=tf.uint8)
+
+        fFrame = __decode_png(
+            parsed['data/first_frame'])
+
+        lFrame = __decode_png(
+            parsed['data/last_frame'])
+
+        iFrame = tf.map_fn(
+            __decode_png,
+            parsed['data/intermediate_frames'],
+            dtype=tf.uint8)
+
+    else:
+        fFrame = tf.decode_raw(
+            parsed['data/first_frame'],
+            tf.uint8)
+
+        lFrame = tf.decode_raw(
+            parsed['data/last_frame'],
+            tf.uint8)
+
+        iFrame = tf.decode_raw(
+            parsed['data/intermediate_frames'],
+            tf.uint8)
+
+    # reshape images
+    fFrame = tf.reshape(
+        fFrame,
+        [-1, height, width, 1])
+
+    lFrame = tf.reshape(
+        lFrame,
+        [-1, height, width, 1])
+
+    iFrame = tf.reshape(
+        iFrame,
+        [-1, n_intermediate_frames, height, width, 1])
+
+    return fFrame, lFrame, iFrame
+
+
+def count_records(filenames, compression_type=''):
+    '''Counts the records of TF Record files without
+    parsing them
+    Args:
+        filenames: 'List' that contains TF Records
+        compression_type: 'String' one of '', 'GZIP' or 'ZLIB'
+    Returns:
+        'Integer' number of records
+    '''
+    options = tf.python_io.TFRecordOptions(
+        compression_type)
+
+    return sum(
+        1
+        for filename in filenames
+        for _ in tf.python_io.tf_record_iterator(
+            filename,
+            options=options))
+
+
+def normalize_frames(*frames):
+    '''Casts uint8 frames to float and scales pixels
+    to [-1, 1]. Used inside the model graph so that
+    batches cross to the device as uint8
+    Args:
+        frames: 'Tensors' of dtype tf.uint8, e.g. first,
+            last and intermediate frames
+    Returns:
+        'List' of 'Tensors' of dtype tf.float32, in the
+        order of :frames
+    '''
+    with tf.name_scope('normalize'):
+        # cast images to float and
+        # pixels in range [-1, 1]
+        return [
+            tf.cast(frame, tf.float32) / 127.5 - 1.
+            for frame in frames]
+
+
+def pad_batch(batches, batch_size):
+    '''Pads a smaller final batch to :batch_size by
+    repeating its first example, so that any dtype can
+    be padded
+    Args:
+        batches: 'List' of 'Tensors' that share the
+            batch dimension
+        batch_size: 'Integer' to pad to
+    Returns:
+        'Tuple' of the padded :batches followed by a
+        tf.float32 mask of shape [batch_size] that is 1
+        for real examples and 0 for padding
+    '''
+    n_samples = tf.shape(batches[0])[0]
+
+    pad_ids = tf.zeros(
+        [batch_size - n_samples],
+        dtype=tf.int32)
+    batches = [
+        tf.concat(
+            [batch, tf.gather(batch, pad_ids)],
+            axis=0)
+        for batch in batches]
+
+    mask = tf.sequence_mask(
+        n_samples,
+        batch_size,
+        dtype=tf.float32)
+
+    return tuple(batches) + (mask,)
+
+
+def read_and_decode(filenames=[], is_training=False,
                     batch_size=32, height=100, width=100,
                     n_intermediate_frames=3,
-                    allow_smaller_final_batch=False):
+                    allow_smaller_final_batch=False,
+                    compression_type='', frame_encoding='raw',
+                    meta_format='names', num_epochs=None,
+                    shuffle_buffer_bytes=256 * 2 ** 20,
+                    normalize=True, pad_final_batch=False,
+                    cache=False, return_dataset=False,
+                    filename_queue=None):
     '''Reads batches of data from TF Records
     Args:
-        filename_queue: 'List' that contains TF Records
+        filenames: 'List' that contains TF Records
         is_training: 'Bool' to specify training mode
         batch_size: 'Integer' to specify number of samples
             to be fetched in each iteration
@@ -21,14 +259,48 @@ def read_and_decode(filename_queue=[], is_training=False,
             number of intermediate frames
         allow_smaller_final_batch: 'Bool' to specify whether
             the last batch is allowed to have samples < batch_size
+        compression_type: 'String' one of '', 'GZIP' or 'ZLIB'
+        frame_encoding: 'String' one of 'raw' or 'png'
+        meta_format: 'String' one of 'names' or 'index'
+        num_epochs: 'Integer' to specify the number of passes
+            over the data. None repeats forever
+        shuffle_buffer_bytes: 'Integer' to cap the memory of the
+            training shuffle buffer, which holds encoded records
+        normalize: 'Bool' to specify whether frames are scaled
+            to [-1, 1] here. If False they stay tf.uint8 and
+            :normalize_frames should be applied in the model
+        pad_final_batch: 'Bool' to specify whether the last
+            batch is padded to :batch_size so that no example
+            is dropped. A mask of real examples is returned
+        cache: 'Bool' to keep the decoded uint8 batches in
+            memory after the first epoch, so that later epochs
+            repeat the same batches without reading the records
+        return_dataset: 'Bool' to return the batched
+            tf.data.Dataset instead of its tensors, e.g. for
+            :get_switchable_batches
+        filename_queue: old name of :filenames, kept so
+            that existing callers still work
     Returns:
-        'Tensors' of dtype tf.float32 containing batches of
+        'Tensors' of dtype tf.float32 (tf.uint8 if not
+        :normalize) containing batches of
         first, intermediate and last frames along with
-        meta information
+        meta information. The meta is the joined file names,
+        or an int64 (cell_id, start_frame_index) pair per
+        example if :meta_format is 'index'. If :pad_final_batch,
+        a fifth tf.float32 'Tensor' of shape [batch_size] is 1
+        for real examples and 0 for padding
     '''
-    reader = tf.TFRecordReader()
-    _, ser = reader.read(
-        filename_queue)
+    if filename_queue is not None:
+        filenames = filename_queue
+
+    AUTOTUNE = tf.data.experimental.AUTOTUNE
+
+    # PNG encoded examples store one string per
+    # intermediate frame
+    if frame_encoding == 'png':
+        iFrame_shape = [n_intermediate_frames]
+    else:
+        iFrame_shape = []
 
     keys_to_features = {
         'data/first_frame': tf.FixedLenFeature(
@@ -38,78 +310,146 @@ def read_and_decode(filename_queue=[], is_training=False,
             [],
             tf.string),
         'data/intermediate_frames': tf.FixedLenFeature(
-            [],
-            tf.string),
-        'data/meta_file_names': tf.FixedLenFeature(
-            [],
+            iFrame_shape,
             tf.string)}
 
-    parsed = tf.parse_single_example(
-        ser,
-        features=keys_to_features)
+    if meta_format == 'index':
+        meta_key = 'data/meta_index'
+        keys_to_features[meta_key] = tf.FixedLenFeature(
+            [2],
+            tf.int64)
+    else:
+        meta_key = 'data/meta_file_names'
+        keys_to_features[meta_key] = tf.FixedLenFeature(
+            [],
+            tf.string)
 
-    fFrame = tf.decode_raw(
-        parsed['data/first_frame'],
-        tf.uint8)
+    def __parse_batch(ser):
+        parsed = tf.parse_example(
+            ser,
+            features=keys_to_features)
 
-    lFrame = tf.decode_raw(
-        parsed['data/last_frame'],
-        tf.uint8)
+        fFrames, lFrames, iFrames = decode_frames(
+            parsed,
+            height=height,
+            width=width,
+            n_intermediate_frames=n_intermediate_frames,
+            frame_encoding=frame_encoding)
 
-    iFrame = tf.decode_raw(
-        parsed['data/intermediate_frames'],
-        tf.uint8)
+        # check flag for augmentations
+        if is_training:
+            fFrames, lFrames, iFrames = tf_augmentations.batch_augment(
+                fFrames,
+                lFrames,
+                iFrames)
 
-    meta_file_names = parsed['data/meta_file_names']
+        if normalize:
+            fFrames, lFrames, iFrames = normalize_frames(
+                fFrames,
+                lFrames,
+                iFrames)
 
-    # reshape images
-    fFrame = tf.reshape(
-        fFrame,
-        [height, width, 1])
+        return fFrames, lFrames, iFrames, parsed[meta_key]
 
-    lFrame = tf.reshape(
-        lFrame,
-        [height, width, 1])
+    def __pad_batch(*batches):
+        return pad_batch(
+            batches,
+            batch_size)
 
-    iFrame = tf.reshape(
-        iFrame,
-        [n_intermediate_frames, height, width, 1])
+    def __set_batch_size(*batches):
+        for batch in batches:
+            batch.set_shape(
+                [batch_size] + batch.get_shape().as_list()[1:])
+
+        return batches
 
-    # check flag for augmentations
+    files = tf.data.Dataset.from_tensor_slices(
+        filenames)
     if is_training:
-        fFrame, lFrame, iFrame = tf_augmentations.augment(
-            fFrame,
-            lFrame,
-            iFrame)
-
-    # cast images to float
-    fFrame = tf.cast(fFrame, tf.float32)
-    lFrame = tf.cast(lFrame, tf.float32)
-    iFrame = tf.cast(iFrame, tf.float32)
-
-    # pixels in range [-1, 1]
-    fFrame = fFrame / 127.5 - 1.
-    lFrame = lFrame / 127.5 - 1.
-    iFrame = iFrame / 127.5 - 1.
-    
+        files = files.shuffle(
+            len(filenames))
+
+    # Read shards concurrently
+    dataset = files.interleave(
+        lambda filename: tf.data.TFRecordDataset(
+            filename,
+            compression_type=compression_type),
+        cycle_length=min(len(filenames), 8),
+        num_parallel_calls=AUTOTUNE)
+
     if is_training:
-        fFrames, lFrames, iFrames, mfn = tf.train.shuffle_batch(
-            [fFrame, lFrame, iFrame, meta_file_names],
-            batch_size=batch_size,
-            capacity=1000000,
-            min_after_dequeue=10000,
-            allow_smaller_final_batch=allow_smaller_final_batch,
-            num_threads=4)
+        # Shuffle still encoded uint8 records. Their size is
+        # bounded by the raw frames, so the buffer length
+        # follows from the byte budget
+        record_bytes = (n_intermediate_frames + 2) * height * width
+        dataset = dataset.shuffle(
+            max(batch_size, shuffle_buffer_bytes // record_bytes))
 
-    else:
-        fFrames, lFrames, iFrames, mfn = tf.train.batch(
-            [fFrame, lFrame, iFrame, meta_file_names],
-            batch_size=batch_size,
-            capacity=10000,
-            allow_smaller_final_batch=allow_smaller_final_batch,
-            num_threads=2)
+    if not cache:
+        dataset = dataset.repeat(
+            num_epochs)
 
-    return fFrames, lFrames, iFrames, mfn
+    # Batch first so that parsing, decoding and
+    # normalization run once per batch
+    dataset = dataset.batch(
+        batch_size,
+        drop_remainder=not (
+            allow_smaller_final_batch or pad_final_batch))
+    dataset = dataset.map(
+        __parse_batch,
+        num_parallel_calls=AUTOTUNE)
+    if pad_final_batch:
+        dataset = dataset.map(
+            __pad_batch,
+            num_parallel_calls=AUTOTUNE)
+
+    # Models read the batch size from static shapes
+    if not allow_smaller_final_batch:
+        dataset = dataset.map(
+            __set_batch_size)
+    if cache:
+        dataset = dataset.cache().repeat(
+            num_epochs)
+    dataset = dataset.prefetch(
+        AUTOTUNE)
+
+    if return_dataset:
+        return dataset
+
+    return dataset.make_one_shot_iterator(
+        ).get_next()
+
+
+def get_switchable_batches(datasets):
+    '''Returns one set of batch tensors that reads from
+    any of :datasets, so that a single model graph serves
+    training and validation
+    Args:
+        datasets: 'List' of datasets from read_and_decode
+            with return_dataset=True. They must share
+            dtypes and shapes
+    Returns:
+        batches: 'Tuple' of batch 'Tensors'
+        handle: tf.string placeholder that selects the
+            dataset. Feed it one of :handles
+        handles: 'List' of tf.string 'Tensors', one per
+            dataset, to be evaluated once with sess.run
+    '''
+    handle = tf.placeholder(
+        tf.string,
+        shape=[],
+        name='dataset_handle')
+
+    iterator = tf.data.Iterator.from_string_handle(
+        handle,
+        datasets[0].output_types,
+        datasets[0].output_shapes)
+
+    handles = [
+        dataset.make_one_shot_iterator().string_handle()
+        for dataset in datasets]
+
+    return iterator.get_next(), handle, handles
 
 
 def unit_test():
@@ -121,27 +461,21 @@ def unit_test():
         'tf_records',
         'slack_20px_fluorescent_window_5')
 
-    filename = 'train.tfrecords'
-    final_path = os.path.join(
+    record_paths, _ = get_record_paths(
         current_path,
-        filename)
+        'train')
 
     with tf.Session().as_default() as sess:
-        train_queue = tf.train.string_input_producer(
-            [final_path], num_epochs=None)
         fFrames, lFrames, iFrames, mfns = read_and_decode(
-            filename_queue=train_queue,
-            is_training=True)
+            filenames=record_paths,
+            is_training=True,
+            **get_record_format(current_path))
 
         init_op = tf.group(
             tf.global_variables_initializer(),
             tf.local_variables_initializer())
         sess.run(init_op)
 
-        coord = tf.train.Coordinator()
-        threads = tf.train.start_queue_runners(
-            coord=coord)
-
         import time
         start = time.time()
         for i in range(200):
@@ -160,6 +494,4 @@ def unit_test():
                     time.time() - start,
                     3))))
 
-        coord.request_stop()
-
 # unit_test()
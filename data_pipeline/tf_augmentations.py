@@ -256,3 +256,129 @@ def augment(fFrame, lFrame, iFrame):
 
     return fFrame, lFrame, iFrame 
 
+
+
+def _sample_shape(frames):
+    '''Returns the shape of per-sample random values
+    that broadcast against a batch of frames
+    Args:
+        frames: 'Tensor' of shape [B, T, H, W, C]
+    Returns:
+        'Tensor' shape [B, 1, 1, 1, 1]
+    '''
+    return tf.stack(
+        [tf.shape(frames)[0], 1, 1, 1, 1])
+
+
+def random_batch_flip(frames, axis):
+    '''Flips each sample of a batch with probability 0.5
+    Args:
+        frames: 'Tensor' of dtype tf.float32 and shape
+            [B, T, H, W, C]
+        axis: 'Integer' axis to flip, 2 for up-down and
+            3 for left-right
+    Returns:
+        Augmented 'Tensor'
+    '''
+    flip = tf.random_uniform(
+        shape=tf.shape(frames)[:1],
+        dtype=tf.float32) > 0.5
+
+    # :flip is a [B] vector, so tf.where picks whole
+    # samples from either tensor
+    return tf.where(
+        flip,
+        tf.reverse(frames, axis=[axis]),
+        frames)
+
+
+def random_batch_brightness(frames):
+    '''Performs per-sample brightness augmentation.
+    Like tf.image.adjust_brightness on tf.uint8 frames,
+    the result saturates to [0, 1]
+    Args:
+        frames: 'Tensor' of dtype tf.float32 in [0, 1]
+            and shape [B, T, H, W, C]
+    Returns:
+        Augmented 'Tensor'
+    '''
+    delta_var = tf.random_uniform(
+        shape=_sample_shape(frames),
+        dtype=tf.float32) * 0.2
+
+    return tf.clip_by_value(
+        frames + delta_var,
+        0.,
+        1.)
+
+
+def random_batch_contrast(frames):
+    '''Performs per-sample contrast augmentation. Like
+    tf.image.adjust_contrast, every frame is scaled
+    around its own mean
+    Args:
+        frames: 'Tensor' of dtype tf.float32 and shape
+            [B, T, H, W, C]
+    Returns:
+        Augmented 'Tensor'
+    '''
+    contrast_factor = tf.random_uniform(
+        shape=_sample_shape(frames),
+        minval=0.9,
+        maxval=1.1,
+        dtype=tf.float32)
+
+    mean = tf.reduce_mean(
+        frames,
+        axis=[2, 3],
+        keepdims=True)
+
+    return (frames - mean) * contrast_factor + mean
+
+
+def batch_augment(fFrames, lFrames, iFrames):
+    '''Performs series of augmentations on a batch
+    with per-sample random parameters
+    Args:
+        fFrames: 'Tensor' of dtype tf.uint8
+            containing first frames [B, H, W, 1]
+        lFrames: 'Tensor' of dtype tf.uint8
+            containing last frames [B, H, W, 1]
+        iFrames: 'Tensor' of dtype tf.uint8
+            containing intermediate frames
+            [B, n_IF, H, W, 1]
+    Returns:
+        Augmented 'Tensors' of dtype tf.uint8
+    '''
+    # Stack to [B, n_IF + 2, H, W, 1] so that all
+    # frames of a sample share the random draws
+    frames = tf.concat(
+        [
+            tf.expand_dims(fFrames, axis=1),
+            iFrames,
+            tf.expand_dims(lFrames, axis=1)],
+        axis=1)
+
+    frames = tf.image.convert_image_dtype(
+        frames,
+        tf.float32)
+
+    frames = random_batch_contrast(
+        random_batch_brightness(
+            random_batch_flip(
+                random_batch_flip(
+                    frames,
+                    axis=2),
+                axis=3)))
+
+    frames = tf.image.convert_image_dtype(
+        tf.clip_by_value(frames, 0., 1.),
+        tf.uint8,
+        saturate=True)
+
+    # Slice :frames to get back individual frames
+    fFrames = frames[:, 0]
+    lFrames = frames[:, -1]
+    iFrames = frames[:, 1:-1]
+
+    return fFrames, lFrames, iFrames
@@ -1,3 +1,6 @@
+import functools
+import json
+import multiprocessing
 import pickle
 import cv2
 import numpy as np
@@ -8,17 +11,16 @@ import argparse
 import tensorflow as tf
 import resize
 
-def get_data(IMAGE_DIR, window):
-    '''Returns list of data points
+def get_frame_index(IMAGE_DIR):
+    '''Returns the sorted frames of every cell
     Args:
         IMAGE_DIR: 'String' that points to
             image directory
-        window: 'Integer' to specify the
-            size of the tuple
     Returns:
-        'List' of data points sampled
-    '''    
-    data = []
+        'Dict' with cell folder names as keys and
+        'List' of sorted frame paths as values
+    '''
+    frame_index = {}
 
     folders = os.listdir(
         IMAGE_DIR)
@@ -32,12 +34,33 @@ def get_data(IMAGE_DIR, window):
             folder_path)
 
         images = sorted(images)
-        images = [
+        frame_index[folder] = [
             os.path.join(
                 folder_path,
                 image)
             for image in images]
 
+    return frame_index
+
+def get_data(IMAGE_DIR, window, frame_index=None):
+    '''Returns list of data points
+    Args:
+        IMAGE_DIR: 'String' that points to
+            image directory
+        window: 'Integer' to specify the
+            size of the tuple
+        frame_index: 'Dict' returned by :get_frame_index.
+            Computed from :IMAGE_DIR if None
+    Returns:
+        'List' of data points sampled
+    '''
+    data = []
+
+    if frame_index is None:
+        frame_index = get_frame_index(
+            IMAGE_DIR)
+
+    for images in frame_index.values():
         for i in range(len(images) - window):
             data.append(images[i : i + window])
 
@@ -73,6 +96,27 @@ def get_splits(data, val_split, test_split):
     return train_data, val_data, test_data
 
 ##### TF helper functions #####
+def shuffle_chunks(data, chunk_size):
+    '''Shuffles runs of overlapping windows. The windows
+    are sorted, cut into contiguous chunks and the chunks
+    are shuffled, so neighbouring windows stay together
+    and share decoded frames while the records spread
+    over the whole split
+    Args:
+        data: 'List' of windows
+        chunk_size: 'Integer' number of windows per chunk
+    Returns:
+        'List' of windows in chunk shuffled order
+    '''
+    data = sorted(data)
+    chunks = [
+        data[start : start + chunk_size]
+        for start in range(0, len(data), chunk_size)]
+    random.shuffle(chunks)
+
+    return [tup for chunk in chunks for tup in chunk]
+
+
 def _bytes_feature(value):
     '''Returns serialized data
     Args:
@@ -84,7 +128,43 @@ def _bytes_feature(value):
         bytes_list=tf.train.BytesList(
             value=[value]))
 
-def feat_example(fFrame, lFrame, iFrames, metaFileNames):
+def _bytes_list_feature(values):
+    '''Returns serialized data
+    Args:
+        values: 'List' of bytes
+    Returns:
+        Serialized data
+    '''
+    return tf.train.Feature(
+        bytes_list=tf.train.BytesList(
+            value=values))
+
+def encode_png(frame):
+    '''Returns PNG encoded bytes of a frame
+    Args:
+        frame: 'Numpy' matrix of dtype np.uint8
+    Returns:
+        'Bytes' of the PNG file
+    '''
+    _, buffer = cv2.imencode(
+        '.png',
+        frame)
+
+    return buffer.tobytes()
+
+def _int64_list_feature(values):
+    '''Returns serialized data
+    Args:
+        values: 'List' of integers
+    Returns:
+        Serialized data
+    '''
+    return tf.train.Feature(
+        int64_list=tf.train.Int64List(
+            value=values))
+
+def feat_example(fFrame, lFrame, iFrames, metaFileNames,
+                frame_encoding='raw', metaIndex=None):
     '''Computes TF examples
     Args:
         fFrame: 'Numpy' matrix of dtype np.float32 containing
@@ -94,24 +174,46 @@ def feat_example(fFrame, lFrame, iFrames, metaFileNames):
         iFrames: 'Numpy' matrix of dtype np.float32 containing
             intermediate frames data
         metaFileNames: 'String' that contains meta information
+        frame_encoding: 'String' one of 'raw' (frame bytes)
+            or 'png' (one PNG per frame)
+        metaIndex: 'Tuple' of (cell_id, start_frame_index).
+            Stored instead of :metaFileNames if given
     '''
     assert fFrame.shape == (100, 100, 1), 'Error'
     assert lFrame.shape == (100, 100, 1), 'Error'
     assert iFrames.shape == (3, 100, 100, 1), 'Error'
 
-    feature = {
-        'data/first_frame': _bytes_feature(
-            tf.compat.as_bytes(
-                fFrame.tostring())),
-        'data/last_frame': _bytes_feature(
+    if frame_encoding == 'png':
+        frame_features = {
+            'data/first_frame': _bytes_feature(
+                encode_png(fFrame)),
+            'data/last_frame': _bytes_feature(
+                encode_png(lFrame)),
+            'data/intermediate_frames': _bytes_list_feature(
+                [encode_png(iFrame) for iFrame in iFrames])}
+
+    else:
+        frame_features = {
+            'data/first_frame': _bytes_feature(
+                tf.compat.as_bytes(
+                    fFrame.tostring())),
+            'data/last_frame': _bytes_feature(
+                tf.compat.as_bytes(
+                    lFrame.tostring())),
+            'data/intermediate_frames': _bytes_feature(
+                tf.compat.as_bytes(
+                    iFrames.tostring()))}
+
+    feature = dict(
+        frame_features)
+
+    if metaIndex is not None:
+        feature['data/meta_index'] = _int64_list_feature(
+            list(metaIndex))
+    else:
+        feature['data/meta_file_names'] = _bytes_feature(
             tf.compat.as_bytes(
-                lFrame.tostring())),
-        'data/intermediate_frames': _bytes_feature(
-            tf.compat.as_bytes(
-                iFrames.tostring())),
-        'data/meta_file_names': _bytes_feature(
-            tf.compat.as_bytes(
-                metaFileNames))}
+                metaFileNames))
 
     example = tf.train.Example(
         features=tf.train.Features(
@@ -141,7 +243,9 @@ def dump_pickle(filename, data):
             handle)
 
 def write_tfr(TFR_DIR, data, targetHeight=100,
-                targetWidth=100):
+                targetWidth=100, cache_size=None,
+                compression_type='', frame_encoding='raw',
+                frame_to_meta=None):
     '''Create TF Records
     Args:
         TFR_DIR: 'String' that points to directory
@@ -151,27 +255,42 @@ def write_tfr(TFR_DIR, data, targetHeight=100,
             of each frame
         targetHeight: 'Integer' to specify the width
             of each frame
+        cache_size: 'Integer' to specify the number of
+            decoded and padded frames kept in memory.
+            Defaults to the window length
+        compression_type: 'String' one of '', 'GZIP'
+            or 'ZLIB'
+        frame_encoding: 'String' one of 'raw' or 'png'
+        frame_to_meta: 'Dict' that maps a frame path to its
+            (cell_id, frame_index). If given, examples store
+            the compact index of their first frame instead
+            of the joined file names
     '''
+    if cache_size is None:
+        cache_size = len(data[0]) if len(data) else 1
+
+    # Overlapping windows share frames, so keep the
+    # most recently used frames decoded and padded
+    @functools.lru_cache(maxsize=cache_size)
+    def load_frame(filename):
+        return resize.pad_image(
+            read_image(filename),
+            targetHeight,
+            targetWidth)
+
     writer = tf.python_io.TFRecordWriter(
-        TFR_DIR)
+        TFR_DIR,
+        options=tf.python_io.TFRecordOptions(
+            compression_type))
 
     for tup_id in range(len(data)):
         tup = data[tup_id]
         metaFileNames = ', '.join(tup)
         fFrame, lFrame = tup[0], tup[-1]
         iFrames = tup[1: -1]
- 
-        fFrame = read_image(fFrame)
-        lFrame = read_image(lFrame)
-        
-        fFrame = resize.pad_image(
-            fFrame,
-            targetHeight,
-            targetWidth)
-        lFrame = resize.pad_image(
-            lFrame,
-            targetHeight,
-            targetWidth)
+
+        fFrame = load_frame(fFrame)
+        lFrame = load_frame(lFrame)
 
         # SANITY CHECK
         height, width = fFrame.shape
@@ -191,13 +310,8 @@ def write_tfr(TFR_DIR, data, targetHeight=100,
             dtype=np.uint8)
 
         for frame_id in range(len(iFrames)):
-            iFrame = read_image(
+            intermediateFrames[frame_id] = load_frame(
                 iFrames[frame_id])
-            iFrame = resize.pad_image(
-                iFrame,
-                targetHeight,
-                targetWidth)
-            intermediateFrames[frame_id] = iFrame
 
         fFrame = np.expand_dims(
             fFrame, axis=-1)
@@ -206,11 +320,18 @@ def write_tfr(TFR_DIR, data, targetHeight=100,
         intermediateFrames = np.expand_dims(
             intermediateFrames, axis=-1)
  
+        if frame_to_meta is not None:
+            metaIndex = frame_to_meta[tup[0]]
+        else:
+            metaIndex = None
+
         example = feat_example(
             fFrame,
             lFrame,
             intermediateFrames,
-            metaFileNames)
+            metaFileNames,
+            frame_encoding=frame_encoding,
+            metaIndex=metaIndex)
 
         writer.write(
             example.SerializeToString())
@@ -221,6 +342,192 @@ def write_tfr(TFR_DIR, data, targetHeight=100,
 
     writer.close()
 
+    cache_info = load_frame.cache_info()
+    print('Decoded {} frames for {} examples.....'.format(
+        cache_info.misses, len(data)))
+
+    return len(data)
+
+
+def get_shard_name(name, shard_id, num_shards):
+    '''Returns the file name of a TF Record shard
+    Args:
+        name: 'String' name of the split, e.g. 'train'
+        shard_id: 'Integer' index of the shard
+        num_shards: 'Integer' total number of shards
+    Returns:
+        'String' file name. A single shard keeps the
+        un-sharded name, e.g. 'train.tfrecords'
+    '''
+    if num_shards == 1:
+        return '{}.tfrecords'.format(name)
+
+    return '{}-{}-of-{}.tfrecords'.format(
+        name,
+        str(shard_id).zfill(5),
+        str(num_shards).zfill(5))
+
+
+def write_shard(job, **kwargs):
+    '''Worker wrapper around :write_tfr for one shard
+    Args:
+        job: 'Tuple' of (shard path, 'List' of samples,
+            'Dict' frame_to_meta or None)
+        kwargs: keyword arguments of :write_tfr
+    Returns:
+        'Integer' number of examples written
+    '''
+    shard_path, data, frame_to_meta = job
+
+    return write_tfr(
+        shard_path,
+        data,
+        frame_to_meta=frame_to_meta,
+        **kwargs)
+
+
+def write_sharded_tfr(TFR_DIR, name, data, num_shards=1,
+                        workers=1, targetHeight=100,
+                        targetWidth=100, compression_type='',
+                        frame_encoding='raw', frame_to_meta=None):
+    '''Create TF Record shards in parallel
+    Args:
+        TFR_DIR: 'String' that points to directory
+            where shards will be written
+        name: 'String' name of the split, e.g. 'train'
+        data: 'List' that stores samples
+        num_shards: 'Integer' number of shards
+        workers: 'Integer' number of writer processes
+        targetHeight: 'Integer' to specify the height
+            of each frame
+        targetWidth: 'Integer' to specify the width
+            of each frame
+        compression_type: 'String' one of '', 'GZIP'
+            or 'ZLIB'
+        frame_encoding: 'String' one of 'raw' or 'png'
+        frame_to_meta: 'Dict' that maps a frame path to its
+            (cell_id, frame_index), see :write_tfr
+    Returns:
+        'Dict' manifest entry with the shard names and
+        their example counts
+    '''
+    # Contiguous chunks keep overlapping windows in
+    # the same shard so the frame cache stays useful
+    bounds = np.linspace(
+        0, len(data), num_shards + 1).astype(int)
+    shard_names = [
+        get_shard_name(name, shard_id, num_shards)
+        for shard_id in range(num_shards)]
+    jobs = []
+    for shard_id in range(num_shards):
+        shard_data = data[bounds[shard_id] : bounds[shard_id + 1]]
+
+        # Only ship the meta of this shard's first
+        # frames to the worker
+        if frame_to_meta is not None:
+            shard_frame_to_meta = {
+                tup[0]: frame_to_meta[tup[0]]
+                for tup in shard_data}
+        else:
+            shard_frame_to_meta = None
+
+        jobs.append((
+            os.path.join(TFR_DIR, shard_names[shard_id]),
+            shard_data,
+            shard_frame_to_meta))
+
+    write = functools.partial(
+        write_shard,
+        targetHeight=targetHeight,
+        targetWidth=targetWidth,
+        compression_type=compression_type,
+        frame_encoding=frame_encoding)
+
+    if workers > 1:
+        pool = multiprocessing.Pool(
+            min(workers, num_shards))
+        counts = pool.map(
+            write,
+            jobs)
+        pool.close()
+        pool.join()
+    else:
+        counts = list(map(
+            write,
+            jobs))
+
+    return {
+        'num_examples': sum(counts),
+        'shards': [
+            {'path': shard_name, 'num_examples': count}
+            for shard_name, count in zip(shard_names, counts)]}
+
+
+def get_compression_type(compression):
+    '''Maps a codec name to a TF Record compression type
+    Args:
+        compression: 'String' one of 'none', 'gzip'
+            or 'zlib'
+    Returns:
+        'String' compression type understood by
+        tf.python_io.TFRecordOptions
+    '''
+    if compression == 'none':
+        return ''
+
+    return compression.upper()
+
+
+def get_frame_to_meta(frame_index):
+    '''Maps every frame to its compact meta index
+    Args:
+        frame_index: 'Dict' with integer cell ids as keys
+            and 'List' of sorted frame paths as values
+    Returns:
+        'Dict' with frame paths as keys and
+        (cell_id, frame_index) tuples as values
+    '''
+    frame_to_meta = {}
+
+    for cell_id, images in frame_index.items():
+        for image_id, image in enumerate(images):
+            frame_to_meta[image] = (cell_id, image_id)
+
+    return frame_to_meta
+
+
+def dump_meta_index(TFR_DIR, frame_index):
+    '''Dumps the side-car index that maps the compact
+    (cell_id, frame_index) meta of each example back
+    to file paths
+    Args:
+        TFR_DIR: 'String' that points to directory
+            where data is written
+        frame_index: 'Dict' with cell ids as keys and
+            'List' of sorted frame paths as values
+    '''
+    with open(os.path.join(TFR_DIR, 'meta_index.json'), 'w') as handle:
+        json.dump(
+            {str(cell_id): frames
+                for cell_id, frames in frame_index.items()},
+            handle)
+
+
+def dump_manifest(TFR_DIR, manifest):
+    '''Dumps the shard manifest of all splits
+    Args:
+        TFR_DIR: 'String' that points to directory
+            where data is written
+        manifest: 'Dict' with split names as keys and
+            manifest entries as values, plus a 'format'
+            entry that describes how records are encoded
+    '''
+    with open(os.path.join(TFR_DIR, 'manifest.json'), 'w') as handle:
+        json.dump(
+            manifest,
+            handle,
+            indent=2)
+
 
 def control(args):
     '''Interface method
@@ -235,16 +542,44 @@ def control(args):
     if not os.path.exists(TFR_DIR):
         os.makedirs(TFR_DIR)
 
+    frame_index = get_frame_index(
+        args.IMAGE_DIR)
+
+    # Compact meta stores integer cell ids. Check the
+    # folder names before any record is written
+    if args.meta_format == 'index':
+        bad_folders = sorted(
+            folder
+            for folder in frame_index
+            if not folder.isdigit())
+        if bad_folders:
+            raise ValueError(
+                '--meta_format index needs integer cell folder names, '
+                'found {}. Use --meta_format names instead'.format(
+                    bad_folders))
+
     data = get_data(
         args.IMAGE_DIR,
-        args.window)
+        args.window,
+        frame_index=frame_index)
 
     train_data, val_data, test_data = get_splits(
         data,
         args.VAL_SPLIT,
         args.TEST_SPLIT)
 
-    # DUMP pickle files
+    # Validation and test are written in temporal order
+    # so that overlapping windows are adjacent and every
+    # frame is decoded once. The train reader only
+    # shuffles within a buffer, so train is written in
+    # shuffled chunks of neighbouring windows instead
+    train_data = shuffle_chunks(
+        train_data,
+        args.train_chunk_size)
+    val_data = sorted(val_data)
+    test_data = sorted(test_data)
+
+    # DUMP pickle files, in the order of the records
     dump_pickle(
         TFR_DIR + '/train_meta_files.pkl',
         train_data)
@@ -258,29 +593,49 @@ def control(args):
 
     # Write TF Records
     print('Splits created.....Writing TFRecords.....')
-    print('Writing train TFR.....')
-    write_tfr(
-        TFR_DIR + '/train.tfrecords',
-        train_data,
-        targetHeight=100,
-        targetWidth=100)
-    print('Finished writing train TFR.....')
-    print('Writing validation TFR.....')
-    write_tfr(
-        TFR_DIR + '/val.tfrecords',
-        val_data,
-        targetHeight=100,
-        targetWidth=100)
-    print('Finished writing validation TFR.....')
-    print('Writing test TFR.....')
-    write_tfr(
-        TFR_DIR + '/test.tfrecords',
-        test_data,
-        targetHeight=100,
-        targetWidth=100)
-    print('Finished writing test TFR.....') 
-    
-   
+    compression_type = get_compression_type(
+        args.compression)
+    manifest = {
+        'format': {
+            'compression_type': compression_type,
+            'frame_encoding': args.frame_encoding,
+            'meta_format': args.meta_format}}
+
+    if args.meta_format == 'index':
+        # Cell folders are named by their integer id
+        frame_index = {
+            int(folder): images
+            for folder, images in frame_index.items()}
+        frame_to_meta = get_frame_to_meta(
+            frame_index)
+        dump_meta_index(
+            TFR_DIR,
+            frame_index)
+    else:
+        frame_to_meta = None
+    for name, split_data in zip(
+            ['train', 'val', 'test'],
+            [train_data, val_data, test_data]):
+        print('Writing {} TFR.....'.format(name))
+        manifest[name] = write_sharded_tfr(
+            TFR_DIR,
+            name,
+            split_data,
+            num_shards=args.num_shards,
+            workers=args.workers,
+            targetHeight=100,
+            targetWidth=100,
+            compression_type=compression_type,
+            frame_encoding=args.frame_encoding,
+            frame_to_meta=frame_to_meta)
+        print('Finished writing {} TFR.....'.format(name))
+
+    dump_manifest(
+        TFR_DIR,
+        manifest)
+    print('Manifest dumped.....')
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='params of running the experiment')
@@ -323,6 +678,49 @@ if __name__ == '__main__':
             'tf_records'),
         help='root path where TF Records will be saved')
 
+    parser.add_argument(
+        '--num_shards',
+        type=int,
+        default=1,
+        help='number of TF Record shards per split')
+
+    parser.add_argument(
+        '--train_chunk_size',
+        type=int,
+        default=16,
+        help='number of neighbouring training windows\
+            written together. Chunks are shuffled, smaller\
+            chunks mix better and decode more frames')
+
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='number of processes that write shards\
+            in parallel')
+
+    parser.add_argument(
+        '--compression',
+        type=str,
+        default='none',
+        choices=['none', 'gzip', 'zlib'],
+        help='compression codec of the TF Records')
+
+    parser.add_argument(
+        '--frame_encoding',
+        type=str,
+        default='raw',
+        choices=['raw', 'png'],
+        help='store frames as raw bytes or as PNGs')
+
+    parser.add_argument(
+        '--meta_format',
+        type=str,
+        default='names',
+        choices=['names', 'index'],
+        help='store joined file names or a compact\
+            (cell_id, start_frame_index) pair per example')
+
     args = parser.parse_args()
 
     control(args)
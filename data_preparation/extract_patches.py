@@ -2,10 +2,13 @@ import numpy as np
 from PIL import Image
 import cv2
 
-from kernel_slide import get_cell_patch as gcp
+from kernel_slide import get_label_stats
+from kernel_slide import get_cell_patches
 
 import pickle
 import argparse
+import functools
+import multiprocessing
 import time
 import os
 
@@ -61,53 +64,113 @@ def get_coordinates(filename, kernel_size):
     image = np.array(
         image)
 
-    unique_ids = get_unique_ids(
+    areas, bounding_boxes = get_label_stats(
         image)
 
+    # '0' represents background and is ignored
+    unique_ids = np.nonzero(
+        areas)[0]
+    unique_ids = unique_ids[unique_ids > 0]
+
     unique_id_to_coordinates = {}
 
-    ctr = 0
     threshold = 500
 
-    created_image = np.zeros(
-        image.shape)
+    # Filter on the precomputed areas. Ids keep the
+    # dtype of the mask, as np.unique would, since
+    # they name the cell folders, e.g. '3.0'
+    cell_ids = unique_ids[
+        areas[unique_ids] > threshold].astype(image.dtype)
 
-    for unique_id in unique_ids:
-        mask = np.where(
-            image == unique_id,
-            1,
-            0)
+    unique_id_to_patch = get_cell_patches(
+        image,
+        kernel_size,
+        unique_ids=cell_ids,
+        bounding_boxes=bounding_boxes)
 
-        count = np.sum(mask)
+    # :loc_h and :loc_w are the (y, x) coordinates
+    # of where the cell starts.
+    for unique_id, (_, loc_h, loc_w) in unique_id_to_patch.items():
+        unique_id_to_coordinates[unique_id] = (
+            loc_h, loc_w)
 
-        if count > threshold:
-            cell_patch, loc_h, loc_w = gcp( 
-                image,
-                kernel_size,
-                unique_id)
+    print('Kept {}/{} ids above {} pixels'.format(
+        len(cell_ids), len(unique_ids), threshold))
 
-            # :loc_h and :loc_w are the (y, x) coordinates
-            # of where the cell starts.
+    return unique_id_to_coordinates
 
-            unique_id_to_coordinates[unique_id] = (
-                loc_h, loc_w)
-            
-            # For debugging purposes
-            cell_patch = np.where(
-                cell_patch == unique_id,
-                250,
-                0)
 
-            # created_image = created_image + masked_image
+def get_fl_files(FL_DIR):
+    '''Returns the sorted fluorescent frames of a movie
+    Args:
+        FL_DIR: 'String' that points to the directory
+            of the movie
+    Returns:
+        'List' of paths of the 'z1c1' frames
+    '''
+    fl_files = os.listdir(FL_DIR)
 
-        ctr += 1        
+    # Filter out files that have 'z1c1' in them
+    fl_files = [
+        FL_DIR + '/' + fl_file
+        for fl_file in fl_files
+        if 'z1c1' in fl_file]
 
-        if ctr % 100 == 0:
-            print('Processed {}/{} ids'.format(
-                ctr, len(unique_ids)))
+    return sorted(fl_files)
 
 
-    return unique_id_to_coordinates
+def crop_cell(fl_image, loc_h, loc_w, slack=15,
+                kernel_size=(80, 80)):
+    '''Crops a single cell from the fluorescent image
+    Args:
+        fl_image: 'Numpy' matrix of the fluorescent image
+        loc_h: 'Integer' y_coord where the cell starts
+        loc_w: 'Integer' x_coord where the cell starts
+        slack: 'Integer' to mention allowance while cropping
+        kernel_size: 'Tuple' that contains the size of the
+            kernel window
+    Returns:
+        'Numpy' matrix of the cell patch
+    '''
+    fl_image_height, fl_image_width = fl_image.shape
+
+    # Fetch the required cell from fluorescence
+    # image using :loc_h and :loc_w. Pad the matrix
+    # with zeros on all sides to allow some slack.
+    # This is done because the cell in subsequent
+    # frames might grow/shrink. Therefore, the
+    # coordinated should be relaxed.
+
+    start_h = loc_h - slack
+    end_h = loc_h + kernel_size[0] + slack
+    start_w = loc_w - slack
+    end_w = loc_w + kernel_size[1] + slack
+
+    # Check for edge cases:
+    if start_h < 0: start_h = 0
+    if end_h >= fl_image_height: end_h = fl_image_height - 1
+    if start_w < 0: start_w = 0
+    if end_w >= fl_image_width: end_w = fl_image_width - 1
+
+    return fl_image[
+        start_h : end_h,
+        start_w : end_w]
+
+
+def get_patch_path(IMAGE_DIR, unique_id, image_counter):
+    '''Returns the path a cell patch is saved to
+    Args:
+        IMAGE_DIR: 'String' that has the path where the
+            extracted cell patches are saved
+        unique_id: class id of the cell
+        image_counter: 'Integer' index of the frame
+    Returns:
+        'String' path of the patch
+    '''
+    return os.path.join(
+        IMAGE_DIR,
+        str(unique_id),
+        'image_{}.png'.format(str(image_counter).zfill(3)))
 
 
 def get_cell_patch(fl_filename, unique_id_to_coordinates,
@@ -135,32 +198,15 @@ def get_cell_patch(fl_filename, unique_id_to_coordinates,
     fl_image = np.array(
         fl_image)
 
-    fl_image_height, fl_image_width = fl_image.shape
-
     for unique_id in unique_id_to_coordinates.keys():
-        loc_h, loc_w = unique_id_to_coordinates[unique_id]    
-        
-        # Fetch the required cell from fluorescence
-        # image using :loc_h and :loc_w. Pad the matrix
-        # with zeros on all sides to allow some slack.
-        # This is done because the cell in subsequent
-        # frames might grow/shrink. Therefore, the
-        # coordinated should be relaxed.
-
-        start_h = loc_h - slack 
-        end_h = loc_h + kernel_size[0] + slack
-        start_w = loc_w - slack 
-        end_w = loc_w + kernel_size[1] + slack
-
-        # Check for edge cases:
-        if start_h < 0: start_h = 0
-        if end_h >= fl_image_height: end_h = fl_image_height - 1
-        if start_w < 0: start_w = 0
-        if end_w >= fl_image_width: end_w = fl_image_width - 1
-
-        cell_patch = fl_image[
-            start_h : end_h,
-            start_w : end_w]
+        loc_h, loc_w = unique_id_to_coordinates[unique_id]
+
+        cell_patch = crop_cell(
+            fl_image,
+            loc_h,
+            loc_w,
+            slack=slack,
+            kernel_size=kernel_size)
 
         # saving the image to disk
         unique_id_str = str(unique_id) # + '_brightfield' 
@@ -173,11 +219,43 @@ def get_cell_patch(fl_filename, unique_id_to_coordinates,
             os.makedirs(image_path)
 
         cv2.imwrite(
-            image_path + '/image_{}.png'.format(
-                str(image_counter).zfill(3)),
+            get_patch_path(
+                IMAGE_DIR,
+                unique_id,
+                image_counter),
             cell_patch)
 
 
+def get_cell_patch_for_frame(job, unique_id_to_coordinates,
+                            slack=15, kernel_size=(80, 80),
+                            IMAGE_DIR=''):
+    '''Worker wrapper around :get_cell_patch for a
+    single fluorescent frame
+    Args:
+        job: 'Tuple' of (image_counter, fl_filename)
+        unique_id_to_coordinates: 'Dict' with unique_id as
+            keys and coordinates as values
+        slack: 'Integer' to mention allowance while cropping
+        kernel_size: 'Tuple' that contains the size of the
+            kernel window
+        IMAGE_DIR: 'String' that has the path where the
+            extracted cell patch will get saved
+    Returns:
+        'Integer' image_counter of the processed frame
+    '''
+    image_counter, fl_filename = job
+
+    get_cell_patch(
+        fl_filename,
+        unique_id_to_coordinates,
+        slack=slack,
+        kernel_size=kernel_size,
+        IMAGE_DIR=IMAGE_DIR,
+        image_counter=image_counter)
+
+    return image_counter
+
+
 def control(args):
     '''Interface function to extract patches and save
     them in respective folders
@@ -217,33 +295,49 @@ def control(args):
     # Extract cells from fluorescent image using the
     # above coordinates and write each extracted patch
     # to respective folder
-    fl_files = os.listdir(args.FL_DIR)
+    fl_files = get_fl_files(
+        args.FL_DIR)
 
-    # Filter out files that have 'z1c1' in them
-    fl_files = [
-        args.FL_DIR + '/' + fl_file
-        for fl_file in fl_files
-        if 'z1c1' in fl_file]
-    fl_files = sorted(fl_files)
+    # Create every cell folder up front so that
+    # workers never race on os.makedirs
+    for unique_id in unique_id_to_coordinates.keys():
+        image_path = os.path.join(
+            args.IMAGE_DIR,
+            str(unique_id))
 
-    image_counter = 0
+        if not os.path.exists(image_path):
+            os.makedirs(image_path)
 
-    for fl_file in fl_files:
-        
-        get_cell_patch(
-            fl_file,
-            unique_id_to_coordinates,
-            slack=args.slack,
-            kernel_size=kernel_size,
-            IMAGE_DIR=args.IMAGE_DIR,
-            image_counter=image_counter)
-            
-        if image_counter % 50 == 0:
-            print('Wrote {}/{} images for each cell'.format(
-                image_counter,
-                len(fl_files)))
-
-        image_counter += 1
+    # :image_counter is the index of the frame in the
+    # sorted list, so naming does not depend on the
+    # order in which workers finish
+    extract_frame = functools.partial(
+        get_cell_patch_for_frame,
+        unique_id_to_coordinates=unique_id_to_coordinates,
+        slack=args.slack,
+        kernel_size=kernel_size,
+        IMAGE_DIR=args.IMAGE_DIR)
+    jobs = list(enumerate(fl_files))
+
+    def __report(results):
+        for n_done, _ in enumerate(results):
+            if n_done % 50 == 0:
+                print('Wrote {}/{} images for each cell'.format(
+                    n_done,
+                    len(fl_files)))
+
+    if args.workers > 1:
+        # the pool is terminated if a worker raises
+        with multiprocessing.Pool(args.workers) as pool:
+            __report(
+                pool.imap_unordered(
+                    extract_frame,
+                    jobs))
+    else:
+        __report(
+            map(
+                extract_frame,
+                jobs))
 
     print('Process complete.....Time taken:{} seconds..'.format(
         str(round(time.time() - start, 3))))
@@ -277,6 +371,13 @@ if __name__ == '__main__':
         default=10,
         help='allowance while cropping')
 
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='number of processes that extract frames\
+            in parallel')
+
     args = parser.parse_args()
     control(args)
 
@@ -1,8 +1,40 @@
 from PIL import Image
 import numpy as np
 import cv2
+from scipy import ndimage
 
-def get_cell_patch(image, kernel_size, unique_id):
+def get_window_counts(indicator, kernel_size):
+    '''Counts the number of set pixels under every
+    kernel window using a summed-area table
+    Args:
+        indicator: 'Numpy' binary matrix of the cell
+            of interest
+        kernel_size: 'Tuple' to mention the size
+            of the kernel window
+    Returns:
+        'Numpy' matrix where entry (h, w) holds the
+        count of the window starting at (h, w)
+    '''
+    # Pad a row and column of zeros so that
+    # :sat[h, w] is the sum of indicator[:h, :w]
+    sat = np.zeros(
+        (indicator.shape[0] + 1, indicator.shape[1] + 1),
+        dtype=np.int64)
+    sat[1:, 1:] = np.cumsum(
+        np.cumsum(
+            indicator,
+            axis=0,
+            dtype=np.int64),
+        axis=1)
+
+    k_h, k_w = kernel_size
+
+    return sat[k_h:, k_w:] - sat[:-k_h, k_w:]\
+        - sat[k_h:, :-k_w] + sat[:-k_h, :-k_w]
+
+
+def get_cell_patch(image, kernel_size, unique_id,
+                    bounding_box=None):
     '''Finds the location of the cell using
     the mask image
     Args:
@@ -11,6 +43,8 @@ def get_cell_patch(image, kernel_size, unique_id):
             of the kernel window
         unique_id: 'Float' to mention the class id
             of the cell of interest
+        bounding_box: 'Tuple' of slices that bound
+            the cell in :image. Computed if None
     Returns:
         image: 'Numpy' matrix of tight bounding box
             segmented cell
@@ -21,29 +55,46 @@ def get_cell_patch(image, kernel_size, unique_id):
     '''
     height, width = image.shape
 
+    # Valid window origins are [0, height) x [0, width)
     height -= kernel_size[0]
     width -= kernel_size[1]
 
-    kernel = np.ones(
-        kernel_size,
-        dtype=np.float32) * unique_id
+    if bounding_box is None:
+        rows, cols = np.nonzero(
+            image == unique_id)
+        bounding_box = (
+            slice(rows.min(), rows.max() + 1),
+            slice(cols.min(), cols.max() + 1))
+
+    # Only windows that overlap the bounding box can
+    # contain the cell, so restrict the search to them
+    start_h = max(bounding_box[0].start - kernel_size[0] + 1, 0)
+    end_h = min(bounding_box[0].stop, height)
+    start_w = max(bounding_box[1].start - kernel_size[1] + 1, 0)
+    end_w = min(bounding_box[1].stop, width)
 
-    max_count = 0
+    assert start_h < end_h and start_w < end_w,\
+        'no window overlaps cell {}'.format(unique_id)
 
-    for h in range(height):
-        for w in range(width):
-            patch = image[
-                h : h + kernel_size[0],
-                w : w + kernel_size[1]]
+    region = image[
+        start_h : end_h + kernel_size[0] - 1,
+        start_w : end_w + kernel_size[1] - 1] == unique_id
 
-            similarity_matrix = patch == kernel
+    counts = get_window_counts(
+        region,
+        kernel_size)
 
-            count = np.sum(similarity_matrix)
+    # np.argmax returns the first maximum in raster
+    # order, same as the strict '>' of a sliding scan
+    store_h, store_w = np.unravel_index(
+        np.argmax(counts),
+        counts.shape)
 
-            if count > max_count:
-                store_h = h
-                store_w = w
-                max_count = count 
+    assert counts[store_h, store_w] > 0,\
+        'no window overlaps cell {}'.format(unique_id)
+
+    store_h = int(store_h) + start_h
+    store_w = int(store_w) + start_w
 
     image = image[
         store_h : store_h + kernel_size[0],
@@ -59,8 +110,69 @@ def get_cell_patch(image, kernel_size, unique_id):
     return image, new_h, new_w
 
 
+def get_label_stats(image):
+    '''Computes the area and bounding box of every
+    label in a single pass over the mask
+    Args:
+        image: 'Numpy' matrix of the mask
+    Returns:
+        areas: 'Numpy' array where areas[i] is the
+            number of pixels with label i
+        bounding_boxes: 'List' where bounding_boxes[i - 1]
+            is a 'Tuple' of slices bounding label i, or
+            None if label i is absent
+    '''
+    labels = image.astype(np.int64)
+
+    areas = np.bincount(
+        labels.ravel())
+
+    bounding_boxes = ndimage.find_objects(
+        labels)
+
+    return areas, bounding_boxes
+
+
+def get_cell_patches(image, kernel_size, unique_ids=None,
+                        bounding_boxes=None):
+    '''Finds the locations of all cells in the mask
+    image with a single pass for bounding boxes
+    Args:
+        image: 'Numpy' matrix of the mask
+        kernel_size: 'Tuple' to mention the size
+            of the kernel window
+        unique_ids: 'List' of class ids of interest.
+            All non-zero ids are used if None
+        bounding_boxes: 'List' returned by
+            :get_label_stats. Computed if None
+    Returns:
+        'Dict' with unique_id as keys and
+        (patch, loc_h, loc_w) tuples as values
+    '''
+    if bounding_boxes is None:
+        _, bounding_boxes = get_label_stats(
+            image)
+
+    if unique_ids is None:
+        unique_ids = [
+            i + 1
+            for i, box in enumerate(bounding_boxes)
+            if box is not None]
+
+    unique_id_to_patch = {}
+
+    for unique_id in unique_ids:
+        unique_id_to_patch[unique_id] = get_cell_patch(
+            image,
+            kernel_size,
+            unique_id,
+            bounding_box=bounding_boxes[int(unique_id) - 1])
+
+    return unique_id_to_patch
+
+
 def get_tight_bounding_box(image, unique_id):
-    '''Computes a tight bounding box over the 
+    '''Computes a tight bounding box over the
     cell of interest
     Args:
         image: 'Numpy' matrix of cropped segmented
@@ -72,20 +184,14 @@ def get_tight_bounding_box(image, unique_id):
             segmented cell
         h: 'Integer' that mentions the adjusted y_coord
         w: 'Integer' that mentions the adjusted x_coord
-    ''' 
-    height, width = image.shape
-
-    for h in range(height):
-        row = image[h, :]
-        if unique_id in row:
-            break
+    '''
+    mask = image == unique_id
 
-    for w in range(width):
-        column = image[:, w]
-        if unique_id in column:
-            break
+    h = int(np.argmax(
+        np.any(mask, axis=1)))
+    w = int(np.argmax(
+        np.any(mask, axis=0)))
 
     image = image[h:, w:]
-    
-    return image, h, w 
 
+    return image, h, w
@@ -0,0 +1,461 @@
+import collections
+import pickle
+import random
+import argparse
+import time
+import os
+
+import numpy as np
+from PIL import Image
+
+import tensorflow as tf
+import resize
+from create_record import feat_example
+from create_record import dump_pickle
+from create_record import dump_manifest
+from create_record import get_compression_type
+from create_record import dump_meta_index
+from create_record import get_splits
+from extract_patches import get_fl_files
+from extract_patches import crop_cell
+from extract_patches import get_patch_path
+
+def to_uint8(image):
+    '''Converts a fluorescent crop to uint8 the same way
+    a cv2.imwrite/cv2.imread(filename, 0) round trip does
+    Args:
+        image: 'Numpy' matrix of the cell patch
+    Returns:
+        'Numpy' matrix of dtype np.uint8
+    '''
+    if image.dtype == np.uint16:
+        # 16-bit PNGs are read back by keeping the
+        # high byte
+        return (image >> 8).astype(np.uint8)
+
+    return np.clip(
+        image,
+        0,
+        255).astype(np.uint8)
+
+
+def get_examples(fl_files, unique_id_to_coordinates, window,
+                slack=10, kernel_size=(80, 80),
+                targetHeight=100, targetWidth=100):
+    '''Streams windows of cell patches from a movie.
+    Each frame is decoded once and every cell keeps a
+    ring buffer of its last :window padded crops
+    Args:
+        fl_files: 'List' of sorted fluorescent frames
+        unique_id_to_coordinates: 'Dict' with unique_id as
+            keys and coordinates as values
+        window: 'Integer' to specify the size of the tuple
+        slack: 'Integer' to mention allowance while cropping
+        kernel_size: 'Tuple' that contains the size of the
+            kernel window
+        targetHeight: 'Integer' to specify the height
+            of each frame
+        targetWidth: 'Integer' to specify the width
+            of each frame
+    Yields:
+        'Tuple' of (unique_id, start_index, frames) where
+        frames is a 'Numpy' matrix of dtype np.uint8 and
+        shape [window, targetHeight, targetWidth]
+    '''
+    buffers = {
+        unique_id: collections.deque(maxlen=window)
+        for unique_id in unique_id_to_coordinates.keys()}
+
+    # Same windows as create_record.get_data, which
+    # samples start indices in range(n_frames - window)
+    n_windows = len(fl_files) - window
+
+    for frame_id, fl_file in enumerate(fl_files):
+        start_index = frame_id - window + 1
+        if start_index >= n_windows:
+            break
+
+        fl_image = np.array(
+            Image.open(fl_file))
+
+        for unique_id in unique_id_to_coordinates.keys():
+            loc_h, loc_w = unique_id_to_coordinates[unique_id]
+
+            cell_patch = crop_cell(
+                fl_image,
+                loc_h,
+                loc_w,
+                slack=slack,
+                kernel_size=kernel_size)
+            cell_patch = resize.pad_image(
+                to_uint8(cell_patch),
+                targetHeight,
+                targetWidth)
+
+            buffers[unique_id].append(cell_patch)
+
+            if start_index >= 0:
+                yield unique_id, start_index, np.stack(
+                    buffers[unique_id])
+
+
+def shuffle_records(bucket_paths, bucket_meta, writer):
+    '''Writes the records of every bucket in a random
+    order and removes the buckets. Only one bucket is
+    held in memory at a time
+    Args:
+        bucket_paths: 'List' of paths of TF Records that
+            were filled in random order
+        bucket_meta: 'List' of 'List' of the meta of every
+            record of a bucket
+        writer: 'TFRecordWriter' of the shuffled records
+    Returns:
+        'List' of meta in the order of the written records
+    '''
+    meta = []
+    for bucket_path, records_meta in zip(bucket_paths, bucket_meta):
+        records = list(
+            tf.python_io.tf_record_iterator(bucket_path))
+
+        order = np.random.permutation(
+            len(records))
+        for record_id in order:
+            writer.write(
+                records[record_id])
+            meta.append(
+                records_meta[record_id])
+
+        os.remove(
+            bucket_path)
+
+    return meta
+
+
+def write_tfr(TFR_DIR, fl_files, unique_id_to_coordinates,
+                window, val_split=0.15, test_split=0.15,
+                slack=10, kernel_size=(80, 80),
+                targetHeight=100, targetWidth=100,
+                compression_type='', frame_encoding='raw',
+                meta_format='names', IMAGE_DIR='',
+                shuffle_buffer_bytes=1024 * 2 ** 20):
+    '''Create train, validation and test TF Records
+    straight from the movie without writing patches
+    Args:
+        TFR_DIR: 'String' that points to directory
+            where data will be written
+        fl_files: 'List' of sorted fluorescent frames
+        unique_id_to_coordinates: 'Dict' with unique_id as
+            keys and coordinates as values
+        window: 'Integer' to specify the size of the tuple
+        val_split: 'Float' to mention the fraction of
+            validation data
+        test_split: 'Float' to mention the fraction of
+            test data
+        slack: 'Integer' to mention allowance while cropping
+        kernel_size: 'Tuple' that contains the size of the
+            kernel window
+        targetHeight: 'Integer' to specify the height
+            of each frame
+        targetWidth: 'Integer' to specify the width
+            of each frame
+        compression_type: 'String' one of '', 'GZIP'
+            or 'ZLIB'
+        frame_encoding: 'String' one of 'raw' or 'png'
+        meta_format: 'String' one of 'names' (joined file
+            names) or 'index' (cell_id, start_index)
+        IMAGE_DIR: 'String' where extract_patches would save
+            the patches. File names in the meta point there,
+            same as create_record
+        shuffle_buffer_bytes: 'Integer' to cap the memory of
+            shuffling the training examples
+    Returns:
+        'Dict' with split names as keys and 'List' of
+        (unique_id, start_index) tuples as values
+    '''
+    splits = ['train', 'validation', 'test']
+    record_names = ['train', 'val', 'test']
+
+    # Same windows and shuffled split as
+    # create_record.get_data and get_splits
+    n_windows = len(fl_files) - window
+    window_splits = get_splits(
+        [
+            (unique_id, start_index)
+            for unique_id in unique_id_to_coordinates.keys()
+            for start_index in range(n_windows)],
+        val_split,
+        test_split)
+    window_to_split = {
+        tup: split
+        for split, split_windows in zip(splits, window_splits)
+        for tup in split_windows}
+
+    writers = {
+        split: tf.python_io.TFRecordWriter(
+            os.path.join(
+                TFR_DIR,
+                record_name + '.tfrecords'),
+            options=tf.python_io.TFRecordOptions(
+                compression_type))
+        for split, record_name in zip(splits, record_names)}
+    meta = {split: [] for split in splits}
+
+    # Examples arrive in temporal order. Training
+    # examples go to random buckets that are shuffled
+    # one at a time, so the train records end up in a
+    # global random order
+    record_bytes = window * targetHeight * targetWidth
+    n_buckets = max(
+        1,
+        -(-len(window_splits[0]) * record_bytes // shuffle_buffer_bytes))
+    bucket_paths = [
+        os.path.join(
+            TFR_DIR,
+            'train.tfrecords.bucket_{}'.format(bucket_id))
+        for bucket_id in range(n_buckets)]
+    bucket_writers = [
+        tf.python_io.TFRecordWriter(bucket_path)
+        for bucket_path in bucket_paths]
+    bucket_meta = [[] for _ in range(n_buckets)]
+
+    examples = get_examples(
+        fl_files,
+        unique_id_to_coordinates,
+        window,
+        slack=slack,
+        kernel_size=kernel_size,
+        targetHeight=targetHeight,
+        targetWidth=targetWidth)
+
+    for tup_id, (unique_id, start_index, frames) in enumerate(examples):
+        split = window_to_split[(unique_id, start_index)]
+
+        if meta_format == 'index':
+            metaFileNames = None
+            metaIndex = (int(unique_id), start_index)
+        else:
+            metaFileNames = ', '.join([
+                get_patch_path(
+                    IMAGE_DIR,
+                    unique_id,
+                    start_index + frame_id)
+                for frame_id in range(window)])
+            metaIndex = None
+
+        frames = np.expand_dims(
+            frames, axis=-1)
+
+        example = feat_example(
+            frames[0],
+            frames[-1],
+            frames[1: -1],
+            metaFileNames,
+            frame_encoding=frame_encoding,
+            metaIndex=metaIndex)
+
+        if split == 'train':
+            bucket_id = random.randrange(n_buckets)
+            bucket_writers[bucket_id].write(
+                example.SerializeToString())
+            bucket_meta[bucket_id].append(
+                (unique_id, start_index))
+        else:
+            writers[split].write(
+                example.SerializeToString())
+            meta[split].append(
+                (unique_id, start_index))
+
+        if tup_id % 5000 == 0:
+            print('Wrote {} examples.....'.format(
+                tup_id))
+
+    for bucket_writer in bucket_writers:
+        bucket_writer.close()
+
+    print('Shuffling {} train examples in {} buckets.....'.format(
+        len(window_splits[0]),
+        n_buckets))
+    meta['train'] = shuffle_records(
+        bucket_paths,
+        bucket_meta,
+        writers['train'])
+
+    for writer in writers.values():
+        writer.close()
+
+    return meta
+
+
+def control(args):
+    '''Interface method
+    Args:
+        args: 'ArgumentParser' containing meta information
+    '''
+    start = time.time()
+
+    TFR_DIR = os.path.join(
+        args.TFR_DIR,
+        'slack_20px_fluorescent_window_{}'.format(
+            args.window))
+
+    if not os.path.exists(TFR_DIR):
+        os.makedirs(TFR_DIR)
+
+    with open(
+        args.IMAGE_DIR + '/meta_file/unique_id_to_coord.pkl',
+        'rb') as handle:
+        unique_id_to_coordinates = pickle.load(
+            handle)
+
+    fl_files = get_fl_files(
+        args.FL_DIR)
+
+    print('Streaming {} frames for {} cells.....'.format(
+        len(fl_files),
+        len(unique_id_to_coordinates)))
+    compression_type = get_compression_type(
+        args.compression)
+    meta = write_tfr(
+        TFR_DIR,
+        fl_files,
+        unique_id_to_coordinates,
+        args.window,
+        val_split=args.VAL_SPLIT,
+        test_split=args.TEST_SPLIT,
+        slack=args.slack,
+        kernel_size=(args.kernel_size, args.kernel_size),
+        targetHeight=100,
+        targetWidth=100,
+        compression_type=compression_type,
+        frame_encoding=args.frame_encoding,
+        meta_format=args.meta_format,
+        IMAGE_DIR=args.IMAGE_DIR,
+        shuffle_buffer_bytes=args.shuffle_buffer_mb * 2 ** 20)
+
+    # DUMP pickle files
+    for split in ['train', 'validation', 'test']:
+        dump_pickle(
+            TFR_DIR + '/{}_meta_files.pkl'.format(split),
+            meta[split])
+        print('{}: {} examples'.format(
+            split,
+            len(meta[split])))
+
+    manifest = {
+        name: {
+            'num_examples': len(meta[split]),
+            'shards': [{
+                'path': name + '.tfrecords',
+                'num_examples': len(meta[split])}]}
+        for name, split in zip(
+            ['train', 'val', 'test'],
+            ['train', 'validation', 'test'])}
+    manifest['format'] = {
+        'compression_type': compression_type,
+        'frame_encoding': args.frame_encoding,
+        'meta_format': args.meta_format}
+    dump_manifest(
+        TFR_DIR,
+        manifest)
+
+    if args.meta_format == 'index':
+        # Every cell is cropped from the same frames
+        dump_meta_index(
+            TFR_DIR,
+            {unique_id: fl_files
+                for unique_id in unique_id_to_coordinates.keys()})
+
+    print('Process complete.....Time taken:{} seconds..'.format(
+        str(round(time.time() - start, 3))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='params of running the experiment')
+
+    parser.add_argument(
+        '--FL_DIR',
+        type=str,
+        default='/neuhaus/movie',
+        help='path to Fluorescent images')
+
+    parser.add_argument(
+        '--IMAGE_DIR',
+        type=str,
+        default='/neuhaus/movie/dataset',
+        help='path that holds meta_file/unique_id_to_coord.pkl.\
+            Meta file names point to the patches under it')
+
+    parser.add_argument(
+        '--kernel_size',
+        type=int,
+        default=80,
+        help='size of kernel window')
+
+    parser.add_argument(
+        '--slack',
+        type=int,
+        default=10,
+        help='allowance while cropping')
+
+    parser.add_argument(
+        '--window',
+        type=int,
+        default=5,
+        help='mentions the number of frames in each\
+            batch. 1 frame corresponds to 6 seconds')
+
+    parser.add_argument(
+        '--VAL_SPLIT',
+        type=float,
+        default=0.15,
+        help='specifies the percentage of data to be\
+            used for validation')
+
+    parser.add_argument(
+        '--TEST_SPLIT',
+        type=float,
+        default=0.15,
+        help='specifies the percentage of data to be\
+            used for testing')
+
+    parser.add_argument(
+        '--TFR_DIR',
+        type=str,
+        default=os.path.join(
+            '/neuhaus/movie/dataset',
+            'tf_records'),
+        help='root path where TF Records will be saved')
+
+    parser.add_argument(
+        '--compression',
+        type=str,
+        default='none',
+        choices=['none', 'gzip', 'zlib'],
+        help='compression codec of the TF Records')
+
+    parser.add_argument(
+        '--frame_encoding',
+        type=str,
+        default='raw',
+        choices=['raw', 'png'],
+        help='store frames as raw bytes or as PNGs')
+
+    parser.add_argument(
+        '--meta_format',
+        type=str,
+        default='names',
+        choices=['names', 'index'],
+        help='store joined file names or a compact\
+            (cell_id, start_frame_index) pair per example')
+
+    parser.add_argument(
+        '--shuffle_buffer_mb',
+        type=int,
+        default=1024,
+        help='Memory budget in MB of shuffling the training\
+            examples before they are written')
+
+    args = parser.parse_args()
+
+    control(args)
@@ -0,0 +1,181 @@
+import os
+import argparse
+os.environ['CUDA_VISIBLE_DEVICES'] = '0'
+
+import warnings
+warnings.filterwarnings("ignore")
+
+import tensorflow as tf
+tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
+from tensorflow.tools.graph_transforms import TransformGraph
+
+from data_pipeline.read_record import normalize_frames
+
+from utils.inference import get_best_checkpoint
+from utils.inference import build_model
+from utils.inference import to_uint8_frames
+from utils.inference import INPUT_NAMES
+from utils.inference import OUTPUT_NAME
+
+def get_transforms(batch_size, height, width):
+    '''Returns the graph transforms applied to the
+    frozen graph
+    Args:
+        batch_size: 'Integer' batch size of the inputs
+        height: 'Integer' height of the frames
+        width: 'Integer' width of the frames
+    Returns:
+        'List' of transform strings
+    '''
+    return [
+        # drop nodes that do not feed the output
+        'strip_unused_nodes(type=uint8, shape="{},{},{},1")'.format(
+            batch_size, height, width),
+        'remove_nodes(op=Identity, op=CheckNumerics)',
+        'fold_constants(ignore_errors=true)',
+        # fold inference batch norm into conv weights
+        'fold_batch_norms',
+        'fold_old_batch_norms',
+        'fold_constants(ignore_errors=true)',
+        'sort_by_execution_order']
+
+
+def export_model(info):
+    '''Freezes a trained model into an optimized GraphDef
+    that takes uint8 first and last frames and returns
+    uint8 interpolated frames
+    Args:
+        info: 'Dict' with model_path, batch_size, height,
+            width, export_path and the model parameters of
+            utils.inference.build_model
+    Returns:
+        'String' path of the exported GraphDef
+    '''
+    batch_size = info['batch_size']
+    height, width = info['height'], info['width']
+
+    tf.reset_default_graph()
+    with tf.Session() as sess:
+        fFrames, lFrames = [
+            tf.placeholder(
+                tf.uint8,
+                shape=[batch_size, height, width, 1],
+                name=name)
+            for name in INPUT_NAMES]
+
+        norm_fFrames, norm_lFrames = normalize_frames(
+            fFrames,
+            lFrames)
+        rec_iFrames = build_model(
+            norm_fFrames,
+            norm_lFrames,
+            info)
+        tf.identity(
+            to_uint8_frames(rec_iFrames),
+            name=OUTPUT_NAME)
+
+        saver = tf.train.Saver()
+        saver.restore(
+            sess,
+            get_best_checkpoint(info['model_path']))
+
+        # Variables become constants, so inference
+        # needs no restore
+        graph_def = tf.graph_util.convert_variables_to_constants(
+            sess,
+            sess.graph.as_graph_def(),
+            [OUTPUT_NAME])
+
+    n_nodes = len(graph_def.node)
+    graph_def = TransformGraph(
+        graph_def,
+        INPUT_NAMES,
+        [OUTPUT_NAME],
+        get_transforms(batch_size, height, width))
+
+    print('Nodes.....frozen:{} optimized:{}'.format(
+        n_nodes,
+        len(graph_def.node)))
+
+    export_path = info['export_path'] or os.path.join(
+        info['model_path'],
+        'frozen_model.pb')
+    with tf.gfile.GFile(export_path, 'wb') as handle:
+        handle.write(
+            graph_def.SerializeToString())
+
+    print('Exported.....{}'.format(
+        export_path))
+
+    return export_path
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='params of exporting a model')
+
+    parser.add_argument(
+        '--model_path',
+        type=str,
+        help='path of the checkpoints to restore')
+
+    parser.add_argument(
+        '--export_path',
+        default='',
+        type=str,
+        help='path of the GraphDef. Defaults to\
+            frozen_model.pb under model_path')
+
+    parser.add_argument(
+        '--model_name',
+        default='wnet',
+        type=str,
+        choices=['wnet', 'slomo', 'bipn'],
+        help='Mention the model to export')
+
+    parser.add_argument(
+        '--n_IF',
+        default=3,
+        type=int,
+        help='Mention the number of frames to interpolate')
+
+    parser.add_argument(
+        '--out_channels',
+        default=8,
+        type=int,
+        help='Mention the out channels of first conv layer')
+
+    parser.add_argument(
+        '--attention',
+        default=0,
+        type=int,
+        help='Mention whether the model uses attention')
+
+    parser.add_argument(
+        '--use_spatial_attention',
+        default=0,
+        type=int,
+        help='Mention whether the attention is spatial')
+
+    parser.add_argument(
+        '--batch_size',
+        default=128,
+        type=int,
+        help='Mention the batch size the graph is frozen for')
+
+    parser.add_argument(
+        '--height',
+        default=100,
+        type=int,
+        help='Mention the height of the frames')
+
+    parser.add_argument(
+        '--width',
+        default=100,
+        type=int,
+        help='Mention the width of the frames')
+
+    args = parser.parse_args()
+
+    export_model(vars(args))
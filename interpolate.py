@@ -0,0 +1,379 @@
+import os
+import time
+import argparse
+import functools
+from concurrent.futures import ThreadPoolExecutor
+os.environ['CUDA_VISIBLE_DEVICES'] = '0'
+
+import warnings
+warnings.filterwarnings("ignore")
+
+import cv2
+import numpy as np
+import tensorflow as tf
+tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
+
+from data_pipeline.read_record import normalize_frames
+from data_pipeline.read_record import pad_batch
+from data_preparation import resize
+
+from utils.inference import get_best_checkpoint
+from utils.inference import build_model
+from utils.inference import to_uint8_frames
+from utils.inference import load_frozen_model
+
+def get_pairs(IMAGE_DIR, gap=1):
+    '''Returns every (first, last) frame pair of
+    every cell movie
+    Args:
+        IMAGE_DIR: 'String' that points to a directory
+            with one folder of frames per cell
+        gap: 'Integer' distance between the first and
+            last frame of a pair
+    Returns:
+        'List' of (cell, first_path, last_path) tuples
+    '''
+    pairs = []
+    for cell in sorted(os.listdir(IMAGE_DIR)):
+        frames = [
+            os.path.join(IMAGE_DIR, cell, image)
+            for image in sorted(os.listdir(
+                os.path.join(IMAGE_DIR, cell)))]
+        for frame_id in range(len(frames) - gap):
+            pairs.append(
+                (cell, frames[frame_id], frames[frame_id + gap]))
+
+    return pairs
+
+
+def get_padding(height, width, targetHeight, targetWidth):
+    '''Returns the top and left padding that
+    resize.pad_image adds
+    Args:
+        height: 'Integer' height of the original frame
+        width: 'Integer' width of the original frame
+        targetHeight: 'Integer' height of the padded frame
+        targetWidth: 'Integer' width of the padded frame
+    Returns:
+        'Tuple' of (pad_top, pad_left)
+    '''
+    return (targetHeight - height) // 2, (targetWidth - width) // 2
+
+
+def load_pairs(pairs, targetHeight=100, targetWidth=100):
+    '''Yields padded uint8 frame pairs
+    Args:
+        pairs: 'List' of (cell, first_path, last_path)
+        targetHeight: 'Integer' to specify the height
+            of each frame
+        targetWidth: 'Integer' to specify the width
+            of each frame
+    Yields:
+        'Tuple' of (first frame, last frame, pair id,
+        original (height, width))
+    '''
+    # consecutive pairs share frames
+    @functools.lru_cache(maxsize=4)
+    def load_frame(filename):
+        image = cv2.imread(
+            filename, 0)
+        return image.shape, resize.pad_image(
+            image,
+            targetHeight,
+            targetWidth)
+
+    for pair_id, (_, first_path, last_path) in enumerate(pairs):
+        shape, fFrame = load_frame(first_path)
+        _, lFrame = load_frame(last_path)
+
+        yield fFrame[..., None], lFrame[..., None],\
+            pair_id, np.array(shape, dtype=np.int64)
+
+
+def write_frames(OUT_DIR, pair, frames, shape,
+                targetHeight=100, targetWidth=100):
+    '''Writes the interpolated frames of a pair, cropped
+    back to the size of the input frames
+    Args:
+        OUT_DIR: 'String' root directory of the output
+        pair: 'Tuple' of (cell, first_path, last_path)
+        frames: 'Numpy' matrix of dtype np.uint8 and
+            shape [n_IF, targetHeight, targetWidth, 1]
+        shape: original (height, width) of the frames
+        targetHeight: 'Integer' height of the padded frame
+        targetWidth: 'Integer' width of the padded frame
+    Returns:
+        'Integer' number of frames written
+    '''
+    cell, first_path, _ = pair
+    height, width = shape
+    pad_top, pad_left = get_padding(
+        height,
+        width,
+        targetHeight,
+        targetWidth)
+
+    stem = os.path.splitext(
+        os.path.basename(first_path))[0]
+
+    for frame_id, frame in enumerate(frames):
+        write_image(
+            os.path.join(
+                OUT_DIR,
+                cell,
+                '{}_{}.png'.format(stem, frame_id + 1)),
+            frame[
+                pad_top: pad_top + height,
+                pad_left: pad_left + width,
+                0])
+
+    return len(frames)
+
+
+def write_image(filename, image):
+    '''Writes an image and raises if cv2 could not,
+    since cv2.imwrite only returns False
+    Args:
+        filename: 'String' path of the image
+        image: 'Numpy' matrix of dtype np.uint8
+    '''
+    if not cv2.imwrite(filename, image):
+        raise IOError(
+            'could not write {}'.format(filename))
+
+
+def collect_writes(futures, wait=False):
+    '''Collects the finished writes of :futures and
+    re-raises their errors
+    Args:
+        futures: 'List' of 'Future' that return the
+            number of frames written
+        wait: 'Bool' to wait for every write
+    Returns:
+        'Integer' number of frames written and the
+        'List' of unfinished futures
+    '''
+    n_written = 0
+    pending = []
+    for future in futures:
+        if wait or future.done():
+            n_written += future.result()
+        else:
+            pending.append(future)
+
+    return n_written, pending
+
+
+def interpolate(info):
+    '''Interpolates :n_IF frames between every frame pair
+    of every cell movie with a trained model
+    Args:
+        info: 'Dict' with IMAGE_DIR, OUT_DIR, model_path,
+            frozen_graph, batch_size, height, width, gap,
+            write_workers and the model parameters of utils.inference.build_model
+    '''
+    pairs = get_pairs(
+        info['IMAGE_DIR'],
+        gap=info['gap'])
+    batch_size = info['batch_size']
+    height, width = info['height'], info['width']
+
+    cells = set(pair[0] for pair in pairs)
+    for cell in cells:
+        if not os.path.exists(os.path.join(info['OUT_DIR'], cell)):
+            os.makedirs(os.path.join(info['OUT_DIR'], cell))
+
+    print('Interpolating {} pairs of {} cells.....'.format(
+        len(pairs),
+        len(cells)))
+
+    tf.reset_default_graph()
+    with tf.Session() as sess:
+        dataset = tf.data.Dataset.from_generator(
+            functools.partial(
+                load_pairs,
+                pairs,
+                targetHeight=height,
+                targetWidth=width),
+            output_types=(tf.uint8, tf.uint8, tf.int64, tf.int64),
+            output_shapes=(
+                [height, width, 1],
+                [height, width, 1],
+                [],
+                [2]))
+
+        # Models read the batch size from static shapes,
+        # so the final batch is padded
+        dataset = dataset.batch(
+            batch_size)
+        dataset = dataset.map(
+            lambda *batches: pad_batch(batches, batch_size))
+        dataset = dataset.prefetch(
+            2)
+
+        batches = dataset.make_one_shot_iterator(
+            ).get_next()
+        for batch in batches:
+            batch.set_shape(
+                [batch_size] + batch.get_shape().as_list()[1:])
+        fFrames, lFrames, pair_ids, shapes, mask = batches
+
+        if info['frozen_graph']:
+            # constants and folded batch norm, no restore
+            rec_iFrames = load_frozen_model(
+                info['frozen_graph'],
+                fFrames,
+                lFrames)
+        else:
+            fFrames, lFrames = normalize_frames(
+                fFrames,
+                lFrames)
+            rec_iFrames = to_uint8_frames(
+                build_model(
+                    fFrames,
+                    lFrames,
+                    info))
+
+            saver = tf.train.Saver()
+            saver.restore(
+                sess,
+                get_best_checkpoint(info['model_path']))
+
+        n_frames = 0
+        pending = []
+        start = time.time()
+
+        # Frames are written by threads while the
+        # next batch is interpolated. Only frames that
+        # were written are counted
+        with ThreadPoolExecutor(info['write_workers']) as writers:
+            while True:
+                try:
+                    frames, ids, frame_shapes, is_pair = sess.run(
+                        [rec_iFrames, pair_ids, shapes, mask])
+                except tf.errors.OutOfRangeError:
+                    break
+
+                for sample_id in range(int(is_pair.sum())):
+                    pending.append(writers.submit(
+                        write_frames,
+                        info['OUT_DIR'],
+                        pairs[ids[sample_id]],
+                        frames[sample_id],
+                        frame_shapes[sample_id],
+                        targetHeight=height,
+                        targetWidth=width))
+
+                n_written, pending = collect_writes(
+                    pending)
+                n_frames += n_written
+                print('{} frames.....{} frames/second'.format(
+                    n_frames,
+                    round(n_frames / (time.time() - start), 2)))
+
+            n_written, _ = collect_writes(
+                pending,
+                wait=True)
+            n_frames += n_written
+
+    print('Process complete.....{} frames in {} seconds..'.format(
+        n_frames,
+        str(round(time.time() - start, 3))))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='params of interpolating cell movies')
+
+    parser.add_argument(
+        '--IMAGE_DIR',
+        type=str,
+        default='/media/data/movie/dataset/cell_patches',
+        help='path with one folder of frames per cell')
+
+    parser.add_argument(
+        '--OUT_DIR',
+        type=str,
+        default='/media/data/movie/dataset/interpolated',
+        help='path where interpolated frames will be saved')
+
+    parser.add_argument(
+        '--model_path',
+        type=str,
+        help='path of the checkpoints to restore')
+
+    parser.add_argument(
+        '--frozen_graph',
+        default='',
+        type=str,
+        help='path of a graph from export_model.py, used\
+            instead of the checkpoints. Its batch size must\
+            match --batch_size')
+
+    parser.add_argument(
+        '--model_name',
+        default='wnet',
+        type=str,
+        choices=['wnet', 'slomo', 'bipn'],
+        help='Mention the model to run')
+
+    parser.add_argument(
+        '--n_IF',
+        default=3,
+        type=int,
+        help='Mention the number of frames to interpolate')
+
+    parser.add_argument(
+        '--out_channels',
+        default=8,
+        type=int,
+        help='Mention the out channels of first conv layer')
+
+    parser.add_argument(
+        '--attention',
+        default=0,
+        type=int,
+        help='Mention whether the model uses attention')
+
+    parser.add_argument(
+        '--use_spatial_attention',
+        default=0,
+        type=int,
+        help='Mention whether the attention is spatial')
+
+    parser.add_argument(
+        '--batch_size',
+        default=128,
+        type=int,
+        help='Mention the number of pairs per session run')
+
+    parser.add_argument(
+        '--height',
+        default=100,
+        type=int,
+        help='Mention the height frames are padded to. wnet\
+            runs on any size, e.g. whole fields of view')
+
+    parser.add_argument(
+        '--width',
+        default=100,
+        type=int,
+        help='Mention the width frames are padded to')
+
+    parser.add_argument(
+        '--gap',
+        default=1,
+        type=int,
+        help='Mention the distance between the first\
+            and last frame of a pair')
+
+    parser.add_argument(
+        '--write_workers',
+        default=4,
+        type=int,
+        help='Mention the number of threads writing frames')
+
+    args = parser.parse_args()
+
+    interpolate(vars(args))
@@ -110,10 +110,29 @@ def encoder(inputs, use_batch_norm=False,
 
     return encode_4, layer_dict
 
+def resize_like(inputs, target):
+
+    # BILINEAR RESIZE of :inputs to the height and width
+    # of :target. Static shapes are compared when known,
+    # e.g. only 24 -> 25 is resized for 100x100 frames
+    inputs_shape = inputs.get_shape().as_list()[1:3]
+    target_shape = target.get_shape().as_list()[1:3]
+
+    if None in inputs_shape + target_shape:
+        target_shape = tf.shape(target)[1:3]
+    elif inputs_shape == target_shape:
+        return inputs
+
+    return tf.image.resize_images(
+        inputs, target_shape,
+        align_corners=True)
+
+
 def upconv_block(inputs, block_name='block_1',
                 use_batch_norm=False,
                 kernel_size=3, stride=1, use_bias=False,
-                out_channels=16, is_training=False):
+                out_channels=16, is_training=False,
+                target=None):
 
     # upconv(x2, c/2) --> 2 convs
     
@@ -122,11 +141,12 @@ def upconv_block(inputs, block_name='block_1',
             kernel_size=(2, 2), strides=(2, 2),
             use_bias=use_bias)
 
-        if block_name == 'block_2':
-            # BILINEAR RESIZE
-            net = tf.image.resize_images(
-                net, (25, 25),
-                align_corners=True)
+        # match the skip connection, pooling rounds
+        # odd sizes so x2 can miss it
+        if target is not None:
+            net = resize_like(
+                net,
+                target)
 
         # Use tanh for the last decoder conv layer
         if block_name == 'block_4':
@@ -151,7 +171,7 @@ def decoder(inputs, layer_dict_fFrames,
             layer_dict_lFrames, use_batch_norm=False,
             n_IF=3, is_training=False,
             is_verbose=False, use_attention=0,
-            spatial_attention=0):
+            spatial_attention=0, output_like=None):
 
     get_shape = inputs.get_shape().as_list()
     out_channels = get_shape[-1]
@@ -162,7 +182,8 @@ def decoder(inputs, layer_dict_fFrames,
         use_batch_norm=True,
         kernel_size=3, stride=1,
         out_channels=out_channels//2,
-        use_bias=True)
+        use_bias=True,
+        target=layer_dict_fFrames['encode_3'])
     if is_verbose: print('Decode_1:{}'.format(decode_1))
 
     # add skip connection
@@ -197,7 +218,8 @@ def decoder(inputs, layer_dict_fFrames,
         use_batch_norm=True,
         kernel_size=3, stride=1,
         out_channels=out_channels//2,
-        use_bias=True)
+        use_bias=True,
+        target=layer_dict_fFrames['encode_2'])
     if is_verbose: print('Decode_2:{}'.format(decode_2))
 
     # add skip connection
@@ -229,7 +251,8 @@ def decoder(inputs, layer_dict_fFrames,
         use_batch_norm=True,
         kernel_size=3, stride=1,
         out_channels=64,
-        use_bias=True)
+        use_bias=True,
+        target=layer_dict_fFrames['encode_1'])
     if is_verbose: print('Decode_3:{}'.format(decode_3))
 
     # add skip connection
@@ -261,7 +284,8 @@ def decoder(inputs, layer_dict_fFrames,
         use_batch_norm=True,
         kernel_size=3, stride=1,
         out_channels=n_IF,
-        use_bias=True)
+        use_bias=True,
+        target=output_like)
     if is_verbose: print('Decode_4:{}'.format(decode_4))
                
     return decode_4
@@ -314,7 +338,8 @@ def build_wnet(fFrames, lFrames, n_IF=3, use_batch_norm=False,
             is_training=is_training,
             is_verbose=is_verbose,
             use_attention=use_attention,
-            spatial_attention=spatial_attention)
+            spatial_attention=spatial_attention,
+            output_like=fFrames)
 
     if input_layer_skip:
         # adding skip connection at the input layer
@@ -20,16 +20,18 @@ window_exp = os.listdir(ROOT_DIR)
 window_exp = [
     i
     for i in window_exp
-    if not i.endswith('csv')]
+    if os.path.isdir(os.path.join(ROOT_DIR, i))]
 
 for window in window_exp:
     models = os.listdir(os.path.join(
         ROOT_DIR, window))
 
+    # skip the records, shards, pickles, manifest.json
+    # and meta_index.json next to the model folders
     models = [
         i
         for i in models
-        if not i.endswith('pkl') and not i.endswith('records')]
+        if os.path.isdir(os.path.join(ROOT_DIR, window, i))]
 
     for model in models:
         files = os.listdir(os.path.join(
@@ -1,5 +1,7 @@
 import os
+import json
 import pickle
+import multiprocessing
 import numpy as np
 import argparse
 os.environ['CUDA_VISIBLE_DEVICES'] = '0'
@@ -12,128 +14,97 @@ tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
 from tensorflow.contrib import summary
 
 from data_pipeline.read_record import read_and_decode
+from data_pipeline.read_record import get_record_paths
+from data_pipeline.read_record import get_record_format
+from data_pipeline.read_record import normalize_frames
+from data_pipeline.read_record import count_records
+from data_pipeline.read_record import load_meta_index
+from data_pipeline.read_record import get_meta_file_names
 
 from utils.optimizer import count_parameters
 from utils.losses import huber_loss
 from utils.losses import l2_loss
 from utils.visualizer import visualize_frames
-from utils.metrics import metric_repeat_fframe
-from utils.metrics import metric_repeat_lframe
-from utils.metrics import metric_weighted_frame
-from utils.metrics import metric_interpolated_frame
+from utils.metrics import streaming_metrics
 
-from models import wnet
-from models import slomo
-from models import BiPN
-from models import vgg16
+from utils.inference import get_best_checkpoint
+from utils.inference import build_model
 
 def testing(info):
     
     # Get the best checkpoint path
-    weight_path = os.listdir(
+    weight_path = get_best_checkpoint(
         info['model_path'])
 
-    weight_paths = [
-        i
-        for i in weight_path
-        if 'meta' in i]
-    di_weight = {}
-    for path in weight_paths:
-        di_weight[path] = int(path.split(':')[-1].split('.')[0])
-    di_weight = {
-        k: v
-        for k, v in sorted(di_weight.items(), key=lambda item: item[1])}
-    weight_path = [*di_weight][0]
-
-    weight_path = weight_path[:-5]
-    weight_path = os.path.join(
-        info['model_path'],
-        weight_path)
-
     n_IF = info['n_IF']
     batch_size = info['batch_size']
-    # get #test_samples based on experiment
-    if n_IF == 3: test_samples = 18300
-    elif n_IF == 4: test_samples = 18296
-    elif n_IF == 5: test_samples = 18265
-    elif n_IF == 6: test_samples = 18235
-    elif n_IF == 7: test_samples = 18204
-    test_iters = test_samples // batch_size
-    test_samples = test_samples - (test_samples % batch_size)
-
-    # get attention
-    if info['attention']:
-        use_attention = 1
-        if info['use_spatial_attention']:
-            spatial_attention = 1
-        else:
-            spatial_attention = 0
-    else:
-        use_attention = 0
-        spatial_attention = 0
+
+    # get #test_samples from the manifest, or count
+    # the records if there is none
+    test_rec_paths, test_samples = get_record_paths(
+        info['TFR_DIR'],
+        'test')
+    record_format = get_record_format(
+        info['TFR_DIR'])
+    if test_samples is None:
+        test_samples = count_records(
+            test_rec_paths,
+            record_format['compression_type'])
+    # the final batch is padded, so no sample is dropped
+    test_iters = -(-test_samples // batch_size)
+
+    # plot only a few evenly spaced batches
+    num_plots = 3
+    plot_iters = set(
+        np.linspace(
+            0,
+            test_iters - 1,
+            num=min(info.get('plot_batches', 10), test_iters),
+            dtype=int).tolist())
+
+    # Plots are rendered by worker processes so that
+    # the session never waits on rendering. Fork before
+    # the session starts any threads
+    plot_pool = multiprocessing.Pool(
+        info.get('plot_workers', 1))
+    plot_results = []
+
+    # frame paths of the plotted samples, so that
+    # every plot can be traced back to its cell
+    plot_path = os.path.join(
+        info['model_path'],
+        'test_plots')
+    plot_file_names = {}
+    if record_format['meta_format'] == 'index':
+        meta_index = load_meta_index(
+            info['TFR_DIR'])
 
     # SCOPING BEGINS HERE
     tf.reset_default_graph()
     with tf.Session() as sess:
         global_step = tf.train.get_global_step()
 
-        test_queue = tf.train.string_input_producer(
-            [info['TEST_REC_PATH']], num_epochs=1)
-        test_fFrames, test_lFrames, test_iFrames, test_mfn =\
-            read_and_decode(
-                filename_queue=test_queue,
+        test_fFrames, test_lFrames, test_iFrames, test_mfn,\
+            test_mask = read_and_decode(
+                filenames=test_rec_paths,
+                num_epochs=1,
                 is_training=False,
                 batch_size=batch_size,
                 n_intermediate_frames=n_IF,
-                allow_smaller_final_batch=False)
-
-        if info['model_name'] in ['skip', 'wnet']:
-            with tf.variable_scope('separate_bipn'):
-                print('TEST FRAMES (first):')
-                if info['model_name'] == 'skip':
-                    test_rec_iFrames = skip_separate_encoder_bipn.build_bipn(
-                        test_fFrames,
-                        test_lFrames,
-                        use_batch_norm=True,
-                        is_training=False,
-                        n_IF=n_IF,
-                        starting_out_channels=info['out_channels'],
-                        use_attention=use_attention,
-                        spatial_attention=spatial_attention,
-                        is_verbose=False)
-
-                elif info['model_name'] == 'wnet':
-                    test_rec_iFrames = wnet.build_wnet(
-                        test_fFrames,
-                        test_lFrames,
-                        use_batch_norm=True,
-                        is_training=False,
-                        n_IF=n_IF,
-                        starting_out_channels=info['out_channels'],
-                        use_attention=use_attention,
-                        spatial_attention=spatial_attention,
-                        is_verbose=False)
-
-        elif info['model_name'] == 'slomo':
-            with tf.variable_scope('slomo'):
-                test_output = slomo.SloMo_model(
-                    test_fFrames,
-                    test_lFrames,
-                    first_kernel=7,
-                    second_kernel=5,
-                    reuse=False,
-                    t_steps=n_IF,
-                    verbose=False)
-                test_rec_iFrames = test_output[0]
-
-        elif info['model_name'] == 'bipn':
-            with tf.variable_scope('bipn'):
-                test_rec_iFrames = BiPN.build_bipn(
-                    test_fFrames,
-                    test_lFrames,
-                    n_IF=n_IF,
-                    use_batch_norm=True,
-                    is_training=False)
+                allow_smaller_final_batch=False,
+                normalize=False,
+                pad_final_batch=True,
+                **record_format)
+        test_fFrames, test_lFrames, test_iFrames = normalize_frames(
+            test_fFrames,
+            test_lFrames,
+            test_iFrames)
+
+        print('TEST FRAMES (first):')
+        test_rec_iFrames = build_model(
+            test_fFrames,
+            test_lFrames,
+            info)
 
         print('Global parameters:{}'.format(
             count_parameters(tf.global_variables())))
@@ -149,19 +120,30 @@ def testing(info):
                 test_iFrames, test_rec_iFrames)
 
         # DEFINE METRICS
-        repeat_fFrame = metric_repeat_fframe(
+        # on real samples only, padding is masked out
+        is_sample = tf.cast(
+            test_mask,
+            tf.bool)
+        sample_fFrames = tf.boolean_mask(
             test_fFrames,
-            test_iFrames)
-        repeat_lFrame = metric_repeat_lframe(
+            is_sample)
+        sample_lFrames = tf.boolean_mask(
             test_lFrames,
-            test_iFrames)
-        weighted_frame = metric_weighted_frame(
-            test_fFrames,
+            is_sample)
+        sample_iFrames = tf.boolean_mask(
             test_iFrames,
-            test_lFrames)
-        inter_frame = metric_interpolated_frame(
-            test_iFrames,
-            test_rec_iFrames)
+            is_sample)
+        sample_rec_iFrames = tf.boolean_mask(
+            test_rec_iFrames,
+            is_sample)
+
+        # accumulated in-graph, so MSE and PSNR are exact
+        # over the whole test set
+        metric_values, metric_update_op = streaming_metrics(
+            sample_fFrames,
+            sample_iFrames,
+            sample_lFrames,
+            sample_rec_iFrames)
 
         init_op = tf.group(
             tf.global_variables_initializer(),
@@ -173,20 +155,9 @@ def testing(info):
         # Load checkpoints
         saver.restore(sess, weight_path)
 
-        coord = tf.train.Coordinator()
-        threads = tf.train.start_queue_runners(
-            coord=coord)
-
         metrics = {}
         metrics['learnable_parameters'] = count_parameters(tf.trainable_variables())
-        metrics['repeat_first'] = []
-        metrics['repeat_last'] = []
-        metrics['weighted_frames'] = []
-        metrics['inter_frames'] = []
-        metrics['repeat_first_psnr'] = []
-        metrics['repeat_last_psnr'] = []
-        metrics['weighted_frames_psnr'] = []
-        metrics['inter_frames_psnr'] = []
+        metrics['test_samples'] = test_samples
 
         print('EVALUATING:{}--------------------------->'.format(
             info['model_path']))
@@ -194,61 +165,83 @@ def testing(info):
         # START TRAINING HERE
         for iteration in range(test_iters):
 
-            # get frames and metrics
-            start_frames, end_frames, mid_frames, rec_mid_frames,\
-            repeat_first, repeat_last, weighted, true_metric = sess.run(
-                [test_fFrames, test_lFrames, test_iFrames, test_rec_iFrames,\
-                repeat_fFrame, repeat_lFrame, weighted_frame,\
-                    inter_frame])
-
-            samples = start_frames.shape[0]
-            metrics['repeat_first'].append(repeat_first[0] * samples)
-            metrics['repeat_last'].append(repeat_last[0] * samples)
-            metrics['weighted_frames'].append(weighted[0] * samples)
-            metrics['inter_frames'].append(true_metric[0] * samples)
-            metrics['repeat_first_psnr'].append(repeat_first[1] * samples)
-            metrics['repeat_last_psnr'].append(repeat_last[1] * samples)
-            metrics['weighted_frames_psnr'].append(weighted[1] * samples)
-            metrics['inter_frames_psnr'].append(true_metric[1] * samples)
-
-            visualize_frames(
-                start_frames,
-                end_frames,
-                mid_frames,
-                rec_mid_frames,
-                training=False,
-                iteration=iteration,
-                save_path=os.path.join(
-                    info['model_path'], 
-                    'test_plots' + '/'))
+            # update metrics, and fetch frames only
+            # for batches that are plotted
+            if iteration in plot_iters:
+                _, start_frames, end_frames, mid_frames, rec_mid_frames,\
+                    mask, meta = sess.run(
+                    [metric_update_op, test_fFrames, test_lFrames,\
+                    test_iFrames, test_rec_iFrames, test_mask, test_mfn])
+
+                # only the plotted samples are sent to the pool
+                samples = min(int(mask.sum()), num_plots)
+
+                if record_format['meta_format'] == 'index':
+                    file_names = [
+                        get_meta_file_names(
+                            meta_index,
+                            sample_meta,
+                            n_IF + 2)
+                        for sample_meta in meta[:samples]]
+                else:
+                    file_names = [
+                        sample_meta.decode().split(', ')
+                        for sample_meta in meta[:samples]]
+                plot_file_names[
+                    'validation_iteration_{}.png'.format(iteration)] = file_names
+
+                result = plot_pool.apply_async(
+                    visualize_frames,
+                    args=(
+                        start_frames[:samples],
+                        end_frames[:samples],
+                        mid_frames[:samples],
+                        rec_mid_frames[:samples]),
+                    kwds={
+                        'training': False,
+                        'iteration': iteration,
+                        'save_path': plot_path + '/',
+                        'num_plots': num_plots})
+                plot_results.append(result)
+            else:
+                sess.run(
+                    metric_update_op)
 
             if iteration % 50 == 0:
                 print('{}/{} iters complete'.format(
                     iteration, test_iters))
 
         print('Testing complete.....')
-        
+
+        final_values = sess.run(
+            metric_values)
+
+    plot_pool.close()
+    plot_pool.join()
+
+    # re-raise the errors of the plotting workers
+    for result in plot_results:
+        result.get()
+
+    if plot_file_names:
+        with open(os.path.join(plot_path, 'file_names.json'), 'w') as handle:
+            json.dump(
+                plot_file_names,
+                handle,
+                indent=2)
 
     # Calculate metrics:
-    mean_rf = sum(metrics['repeat_first']) / test_samples
-    mean_rl = sum(metrics['repeat_last']) / test_samples
-    mean_wf = sum(metrics['weighted_frames']) / test_samples
-    mean_if = sum(metrics['inter_frames']) / test_samples
-
-    metrics['mean_repeat_first'] = mean_rf
-    metrics['mean_repeat_last'] = mean_rl
-    metrics['mean_weighted_frames'] = mean_wf
-    metrics['mean_inter_frames'] = mean_if
-
-    mean_rf_psnr = sum(metrics['repeat_first_psnr']) / test_samples
-    mean_rl_psnr = sum(metrics['repeat_last_psnr']) / test_samples
-    mean_wf_psnr = sum(metrics['weighted_frames_psnr']) / test_samples
-    mean_if_psnr = sum(metrics['inter_frames_psnr']) / test_samples
-
-    metrics['mean_psnr_repeat_first'] = mean_rf_psnr
-    metrics['mean_psnr_repeat_last'] = mean_rl_psnr
-    metrics['mean_psnr_weighted_frames'] = mean_wf_psnr
-    metrics['mean_psnr_inter_frames'] = mean_if_psnr
+    for metric_name, values in final_values.items():
+        metrics['mean_' + metric_name] = float(values['mse'])
+        metrics['mean_psnr_' + metric_name] = float(values['psnr'])
+        # breakdown by intermediate frame index
+        metrics['frame_' + metric_name] = values['frame_mse'].tolist()
+        metrics['frame_psnr_' + metric_name] = values['frame_psnr'].tolist()
+
+        print('{}: mse:{} psnr:{}'.format(
+            metric_name,
+            round(metrics['mean_' + metric_name], 5),
+            round(metrics['mean_psnr_' + metric_name], 3)))
 
     with open(info['model_path'] + '/evaluation.pkl', 'wb') as handle:
         pickle.dump(metrics, handle)
@@ -278,6 +271,18 @@ if __name__ == '__main__':
         type=int,
         help='Mention the out channels of first conv layer')
 
+    parser.add_argument(
+        '--plot_batches',
+        default=10,
+        type=int,
+        help='Mention the number of test batches to plot')
+
+    parser.add_argument(
+        '--plot_workers',
+        default=1,
+        type=int,
+        help='Mention the number of processes rendering plots')
+
     args = parser.parse_args()
 
     ROOT_DIR = '/media/data/movie/dataset/tf_records/'
@@ -299,7 +304,9 @@ if __name__ == '__main__':
     info['out_channels'] = out_channels
     info['attention'] = 0
     info['use_spatial_attention'] = 1
-    info['TEST_REC_PATH'] = os.path.join(ROOT_DIR, exp_name, 'test.tfrecords')
+    info['TFR_DIR'] = os.path.join(ROOT_DIR, exp_name)
+    info['plot_batches'] = args.plot_batches
+    info['plot_workers'] = args.plot_workers
 
     testing(info)
 
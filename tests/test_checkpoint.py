@@ -0,0 +1,87 @@
+import os
+import json
+
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from utils.checkpoint import CheckpointManager
+from utils.checkpoint import INDEX_NAME
+
+
+class FakeSaver(object):
+    '''Writes empty V2 checkpoint files instead of
+    variables
+    '''
+    def export_meta_graph(self, filename):
+        open(filename, 'w').close()
+
+    def save(self, sess, save_path, **kwargs):
+        for suffix in ['.index', '.data-00000-of-00001']:
+            open(save_path + suffix, 'w').close()
+
+
+def kept_steps(ckpt_path):
+    with open(os.path.join(ckpt_path, INDEX_NAME), 'r') as handle:
+        return [
+            checkpoint['step']
+            for checkpoint in json.load(handle)['checkpoints']]
+
+
+def saved_prefixes(ckpt_path):
+    return sorted(
+        name[:-len('.index')]
+        for name in os.listdir(ckpt_path)
+        if name.endswith('.index'))
+
+
+def test_keeps_every_checkpoint_while_fewer_than_last_n(tmpdir):
+    ckpt_path = str(tmpdir)
+    checkpoints = CheckpointManager(
+        FakeSaver(),
+        ckpt_path,
+        keep_best_k=1,
+        keep_last_n=5)
+
+    for step, val_loss in enumerate([0.1, 0.9, 0.8, 0.7, 0.6]):
+        checkpoints.save(None, step, val_loss)
+        assert kept_steps(ckpt_path) == list(range(step + 1))
+
+    # the best one and the 5 most recent
+    checkpoints.save(None, 5, 0.5)
+    assert kept_steps(ckpt_path) == [0, 1, 2, 3, 4, 5]
+    checkpoints.save(None, 6, 0.4)
+    assert kept_steps(ckpt_path) == [0, 2, 3, 4, 5, 6]
+    assert len(saved_prefixes(ckpt_path)) == 6
+
+
+def test_keeps_best_k_and_last_n(tmpdir):
+    ckpt_path = str(tmpdir)
+    checkpoints = CheckpointManager(
+        FakeSaver(),
+        ckpt_path,
+        keep_best_k=2,
+        keep_last_n=1)
+
+    for step, val_loss in enumerate([5., 3., 4., 1., 6., 7., 2.]):
+        checkpoints.save(None, step, val_loss)
+
+    assert kept_steps(ckpt_path) == [3, 6]
+    assert saved_prefixes(ckpt_path) == ['iter:3_val:1.0', 'iter:6_val:2.0']
+
+    with open(os.path.join(ckpt_path, INDEX_NAME), 'r') as handle:
+        assert json.load(handle)['best']['step'] == 3
+
+
+def test_keep_last_n_zero_keeps_best_only(tmpdir):
+    ckpt_path = str(tmpdir)
+    checkpoints = CheckpointManager(
+        FakeSaver(),
+        ckpt_path,
+        keep_best_k=1,
+        keep_last_n=0)
+
+    for step, val_loss in enumerate([0.3, 0.1, 0.2]):
+        checkpoints.save(None, step, val_loss)
+
+    assert kept_steps(ckpt_path) == [1]
@@ -0,0 +1,394 @@
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+os.environ['CUDA_VISIBLE_DEVICES'] = '0'
+
+import warnings
+warnings.filterwarnings("ignore")
+
+import cv2
+import numpy as np
+import tensorflow as tf
+tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
+
+from data_pipeline.read_record import normalize_frames
+
+from utils.inference import get_best_checkpoint
+from utils.inference import build_model
+from utils.inference import to_uint8_frames
+from utils.inference import load_frozen_model
+from utils.tiling import get_tiles
+from utils.tiling import get_feather_weights
+from utils.tiling import stitch_tiles
+
+from interpolate import write_image
+from interpolate import collect_writes
+
+def get_fl_pairs(FL_DIR, movie, gap=1):
+    '''Returns every (first, last) pair of the
+    fluorescent frames of one flat movie folder. Same
+    'z1c1' filter as extract_patches.get_fl_files, whose
+    sibling imports only resolve inside data_preparation
+    Args:
+        FL_DIR: 'String' that points to the directory
+            of the movie
+        movie: 'String' name of the movie in the output
+        gap: 'Integer' distance between the first and
+            last frame of a pair
+    Returns:
+        'List' of (movie, first_path, last_path) tuples
+    '''
+    fl_files = sorted(
+        os.path.join(FL_DIR, fl_file)
+        for fl_file in os.listdir(FL_DIR)
+        if 'z1c1' in fl_file)
+
+    return [
+        (movie, fl_files[frame_id], fl_files[frame_id + gap])
+        for frame_id in range(len(fl_files) - gap)]
+
+
+def get_movie_pairs(IMAGE_DIR, gap=1):
+    '''Returns the frame pairs of full frame movies.
+    :IMAGE_DIR is either one flat movie folder of
+    z1c1/z1c2 files, or holds one such folder per movie
+    Args:
+        IMAGE_DIR: 'String' that points to the movies
+        gap: 'Integer' distance between the first and
+            last frame of a pair
+    Returns:
+        'List' of (movie, first_path, last_path) tuples.
+        The movie of a flat folder is ''
+    '''
+    names = sorted(os.listdir(IMAGE_DIR))
+
+    if any('z1c1' in name for name in names):
+        return get_fl_pairs(
+            IMAGE_DIR,
+            '',
+            gap=gap)
+
+    pairs = []
+    for name in names:
+        if os.path.isdir(os.path.join(IMAGE_DIR, name)):
+            pairs += get_fl_pairs(
+                os.path.join(IMAGE_DIR, name),
+                name,
+                gap=gap)
+
+    return pairs
+
+
+def read_frame(filename):
+    '''Reads a full frame as uint8. 16-bit frames keep
+    their high byte, same as stream_record.to_uint8
+    Args:
+        filename: 'String' containing path to image
+    Returns:
+        'Numpy' grayscale image of dtype np.uint8
+    '''
+    image = cv2.imread(
+        filename,
+        cv2.IMREAD_ANYDEPTH)
+
+    if image.dtype == np.uint16:
+        return (image >> 8).astype(np.uint8)
+
+    return image
+
+
+def load_tiles(pairs, batch_size, tile_size, overlap):
+    '''Tiles the first and last frames of :pairs into
+    one batch, padded with blank tiles
+    Args:
+        pairs: 'List' of (movie, first_path, last_path)
+        batch_size: 'Integer' number of tiles per batch
+        tile_size: 'Tuple' (height, width) of a tile
+        overlap: 'Tuple' (height, width) of the overlap
+    Returns:
+        'Tuple' of first and last frame tiles, each a
+        'Numpy' matrix of shape [batch_size, H, W, 1]
+    '''
+    batches = []
+    for frame_id in [1, 2]:
+        tiles = np.concatenate([
+            get_tiles(
+                read_frame(pair[frame_id]),
+                tile_size=tile_size,
+                overlap=overlap)[0]
+            for pair in pairs])
+
+        batch = np.zeros(
+            (batch_size,) + tile_size + (1,),
+            dtype=np.uint8)
+        batch[:len(tiles), ..., 0] = tiles
+        batches.append(batch)
+
+    return batches
+
+
+def write_stitched(OUT_DIR, pair, tiles, origins,
+                    frame_shape, weights):
+    '''Blends the interpolated tiles of a pair into
+    full frames and writes them
+    Args:
+        OUT_DIR: 'String' root directory of the output
+        pair: 'Tuple' of (movie, first_path, last_path)
+        tiles: 'Numpy' matrix of shape [n_tiles, n_IF, H, W]
+        origins: 'List' of (top, left) of every tile
+        frame_shape: 'Tuple' (height, width) of the frame
+        weights: 'Numpy' feathering weights of a tile
+    Returns:
+        'Integer' number of frames written
+    '''
+    movie, first_path, _ = pair
+    frames = stitch_tiles(
+        tiles,
+        origins,
+        frame_shape,
+        weights)
+
+    stem = os.path.splitext(
+        os.path.basename(first_path))[0]
+
+    for frame_id, frame in enumerate(frames):
+        write_image(
+            os.path.join(
+                OUT_DIR,
+                movie,
+                '{}_{}.png'.format(stem, frame_id + 1)),
+            np.round(frame).astype(np.uint8))
+
+    return len(frames)
+
+
+def tiled_interpolate(info):
+    '''Interpolates full frames by running the model
+    on overlapping tiles and feathering them together.
+    All tiles of :pairs_per_run frame pairs go through
+    one session run
+    Args:
+        info: 'Dict' with IMAGE_DIR, OUT_DIR, model_path,
+            frozen_graph, tile_size, overlap, pairs_per_run,
+            gap, write_workers and the model parameters of
+            utils.inference.build_model
+    '''
+    pairs = get_movie_pairs(
+        info['IMAGE_DIR'],
+        gap=info['gap'])
+    assert pairs,\
+        'no z1c1 frame pairs found in {}'.format(info['IMAGE_DIR'])
+    tile_size = (info['tile_size'], info['tile_size'])
+    overlap = (info['overlap'], info['overlap'])
+
+    # every frame of the movies shares a shape
+    frame_shape = read_frame(pairs[0][1]).shape
+    _, origins = get_tiles(
+        np.zeros(frame_shape),
+        tile_size=tile_size,
+        overlap=overlap)
+    weights = get_feather_weights(
+        tile_size=tile_size,
+        overlap=overlap)
+
+    n_tiles = len(origins)
+    pairs_per_run = info['pairs_per_run']
+    batch_size = n_tiles * pairs_per_run
+
+    for movie in set(pair[0] for pair in pairs):
+        if not os.path.exists(os.path.join(info['OUT_DIR'], movie)):
+            os.makedirs(os.path.join(info['OUT_DIR'], movie))
+
+    print('Interpolating {} pairs of {} frames.....{} tiles per run'.format(
+        len(pairs),
+        frame_shape,
+        batch_size))
+
+    tf.reset_default_graph()
+    with tf.Session() as sess:
+        fFrames, lFrames = [
+            tf.placeholder(
+                tf.uint8,
+                shape=[batch_size] + list(tile_size) + [1])
+            for _ in range(2)]
+
+        if info['frozen_graph']:
+            rec_iFrames = load_frozen_model(
+                info['frozen_graph'],
+                fFrames,
+                lFrames)
+        else:
+            norm_fFrames, norm_lFrames = normalize_frames(
+                fFrames,
+                lFrames)
+            rec_iFrames = to_uint8_frames(
+                build_model(
+                    norm_fFrames,
+                    norm_lFrames,
+                    info))
+
+            saver = tf.train.Saver()
+            saver.restore(
+                sess,
+                get_best_checkpoint(info['model_path']))
+
+        chunks = [
+            pairs[i: i + pairs_per_run]
+            for i in range(0, len(pairs), pairs_per_run)]
+
+        n_frames = 0
+        pending = []
+        start = time.time()
+
+        # Tiles of the next chunk are cut and blended
+        # frames are written while the model runs
+        with ThreadPoolExecutor(1) as loader,\
+            ThreadPoolExecutor(info['write_workers']) as writers:
+            next_tiles = loader.submit(
+                load_tiles,
+                chunks[0],
+                batch_size,
+                tile_size,
+                overlap)
+
+            for chunk_id, chunk in enumerate(chunks):
+                fTiles, lTiles = next_tiles.result()
+                if chunk_id + 1 < len(chunks):
+                    next_tiles = loader.submit(
+                        load_tiles,
+                        chunks[chunk_id + 1],
+                        batch_size,
+                        tile_size,
+                        overlap)
+
+                tiles = sess.run(
+                    rec_iFrames,
+                    feed_dict={fFrames: fTiles, lFrames: lTiles})
+
+                for pair_id, pair in enumerate(chunk):
+                    pending.append(writers.submit(
+                        write_stitched,
+                        info['OUT_DIR'],
+                        pair,
+                        tiles[pair_id * n_tiles: (pair_id + 1) * n_tiles, ..., 0],
+                        origins,
+                        frame_shape,
+                        weights))
+
+                # only frames that were written are counted
+                n_written, pending = collect_writes(
+                    pending)
+                n_frames += n_written
+                print('{} frames.....{} frames/second'.format(
+                    n_frames,
+                    round(n_frames / (time.time() - start), 2)))
+
+            n_written, _ = collect_writes(
+                pending,
+                wait=True)
+            n_frames += n_written
+
+    print('Process complete.....{} frames in {} seconds..'.format(
+        n_frames,
+        str(round(time.time() - start, 3))))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='params of interpolating full frame movies')
+
+    parser.add_argument(
+        '--IMAGE_DIR',
+        type=str,
+        default='/media/data/movie',
+        help='path of a movie folder with z1c1/z1c2 frames,\
+            or with one such folder per movie. Only the\
+            z1c1 frames are interpolated')
+
+    parser.add_argument(
+        '--OUT_DIR',
+        type=str,
+        default='/media/data/movie/interpolated',
+        help='path where interpolated frames will be saved')
+
+    parser.add_argument(
+        '--model_path',
+        type=str,
+        help='path of the checkpoints to restore')
+
+    parser.add_argument(
+        '--frozen_graph',
+        default='',
+        type=str,
+        help='path of a graph from export_model.py, used\
+            instead of the checkpoints. Its batch size must\
+            be the number of tiles per run')
+
+    parser.add_argument(
+        '--model_name',
+        default='wnet',
+        type=str,
+        choices=['wnet', 'slomo', 'bipn'],
+        help='Mention the model to run')
+
+    parser.add_argument(
+        '--n_IF',
+        default=3,
+        type=int,
+        help='Mention the number of frames to interpolate')
+
+    parser.add_argument(
+        '--out_channels',
+        default=8,
+        type=int,
+        help='Mention the out channels of first conv layer')
+
+    parser.add_argument(
+        '--attention',
+        default=0,
+        type=int,
+        help='Mention whether the model uses attention')
+
+    parser.add_argument(
+        '--use_spatial_attention',
+        default=0,
+        type=int,
+        help='Mention whether the attention is spatial')
+
+    parser.add_argument(
+        '--tile_size',
+        default=100,
+        type=int,
+        help='Mention the size of the square tiles')
+
+    parser.add_argument(
+        '--overlap',
+        default=20,
+        type=int,
+        help='Mention the pixels shared by neighbouring tiles')
+
+    parser.add_argument(
+        '--pairs_per_run',
+        default=1,
+        type=int,
+        help='Mention the number of frame pairs whose tiles\
+            go through one session run')
+
+    parser.add_argument(
+        '--gap',
+        default=1,
+        type=int,
+        help='Mention the distance between the first\
+            and last frame of a pair')
+
+    parser.add_argument(
+        '--write_workers',
+        default=4,
+        type=int,
+        help='Mention the number of threads writing frames')
+
+    args = parser.parse_args()
+
+    tiled_interpolate(vars(args))
@@ -11,6 +11,11 @@ tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
 from tensorflow.contrib import summary
 
 from data_pipeline.read_record import read_and_decode
+from data_pipeline.read_record import get_record_paths
+from data_pipeline.read_record import get_record_format
+from data_pipeline.read_record import normalize_frames
+from data_pipeline.read_record import get_switchable_batches
+from data_pipeline.read_record import count_records
 
 from utils.optimizer import get_optimizer
 from utils.optimizer import count_parameters
@@ -22,7 +27,12 @@ from utils.losses import ssim_loss
 from utils.losses import ridge_weight_decay
 from utils.losses import perceptual_loss
 from utils.losses import tf_perceptual_loss
+from utils.losses import mask_padding
 from utils.visualizer import visualize_frames
+from utils.progress import ProgressLine
+from utils.validation import full_validation
+from utils.validation import batch_validation
+from utils.checkpoint import CheckpointManager
 
 from models import wnet
 from models import vgg16
@@ -32,14 +42,21 @@ def training(args):
     # DIRECTORY FOR CKPTS and META FILES
     # ROOT_DIR = '/neuhaus/movie/dataset/tf_records'
     ROOT_DIR = '/media/data/movie/dataset/tf_records'
-    TRAIN_REC_PATH = os.path.join(
+    TFR_DIR = os.path.join(
         ROOT_DIR,
-        args.experiment_name,
-        'train.tfrecords')
-    VAL_REC_PATH = os.path.join(
-        ROOT_DIR,
-        args.experiment_name,
-        'val.tfrecords')
+        args.experiment_name)
+    TRAIN_REC_PATHS, _ = get_record_paths(
+        TFR_DIR,
+        'train')
+    VAL_REC_PATHS, VAL_SAMPLES = get_record_paths(
+        TFR_DIR,
+        'val')
+    RECORD_FORMAT = get_record_format(
+        TFR_DIR)
+    if VAL_SAMPLES is None:
+        VAL_SAMPLES = count_records(
+            VAL_REC_PATHS,
+            RECORD_FORMAT['compression_type'])
     CKPT_PATH = os.path.join(
         ROOT_DIR,
         args.experiment_name,
@@ -49,60 +66,69 @@ def training(args):
     with tf.Session().as_default() as sess:
         global_step = tf.train.get_global_step()
 
-        train_queue = tf.train.string_input_producer(
-            [TRAIN_REC_PATH], num_epochs=None)
-        train_fFrames, train_lFrames, train_iFrames, train_mfn =\
-            read_and_decode(
-                filename_queue=train_queue,
-                is_training=True,
-                batch_size=args.batch_size,
-                n_intermediate_frames=args.n_IF)
-
-        val_queue = tf.train.string_input_producer(
-            [VAL_REC_PATH], num_epochs=None)
-        val_fFrames, val_lFrames, val_iFrames, val_mfn = \
-            read_and_decode(
-                filename_queue=val_queue,
-                is_training=False,
-                batch_size=args.batch_size,
-                n_intermediate_frames=args.n_IF)
+        # The training set repeats forever, so its
+        # mask of real examples is all ones
+        train_dataset = read_and_decode(
+            filenames=TRAIN_REC_PATHS,
+            is_training=True,
+            shuffle_buffer_bytes=args.shuffle_buffer_mb * 2 ** 20,
+            batch_size=args.batch_size,
+            n_intermediate_frames=args.n_IF,
+            normalize=False,
+            pad_final_batch=True,
+            return_dataset=True,
+            **RECORD_FORMAT)
+
+        # The whole validation set is decoded once and
+        # kept in memory. Its final batch is padded
+        val_dataset = read_and_decode(
+            filenames=VAL_REC_PATHS,
+            is_training=False,
+            batch_size=args.batch_size,
+            n_intermediate_frames=args.n_IF,
+            normalize=False,
+            pad_final_batch=True,
+            cache=True,
+            return_dataset=True,
+            **RECORD_FORMAT)
+
+        # One model graph for training and validation,
+        # switched by the dataset handle and :is_training
+        (fFrames, lFrames, iFrames, mfn, mask),\
+            data_handle, (train_handle, val_handle) = get_switchable_batches(
+                [train_dataset, val_dataset])
+        fFrames, lFrames, iFrames = normalize_frames(
+            fFrames,
+            lFrames,
+            iFrames)
+        is_training = tf.placeholder_with_default(
+            False,
+            shape=[],
+            name='is_training')
 
         # Ignore scoping name
         with tf.variable_scope('separate_bipn'):
             print('TRAIN FRAMES (first):')
-            train_rec_iFrames = wnet.build_wnet(
-                train_fFrames,
-                train_lFrames,
+            rec_iFrames = wnet.build_wnet(
+                fFrames,
+                lFrames,
                 use_batch_norm=True,
-                is_training=True,
+                is_training=is_training,
                 n_IF=args.n_IF,
                 starting_out_channels=args.starting_out_channels,
                 use_attention=args.use_attention,
                 spatial_attention=args.spatial_attention,
                 is_verbose=True)
-
-        with tf.variable_scope('separate_bipn', reuse=tf.AUTO_REUSE):
-            print('VAL FRAMES (first):')
-            val_rec_iFrames = wnet.build_wnet(
-                val_fFrames,
-                val_lFrames,
-                use_batch_norm=True,
-                is_training=False,
-                n_IF=args.n_IF,
-                starting_out_channels=args.starting_out_channels,
-                use_attention=args.use_attention,
-                spatial_attention=args.spatial_attention,
-                is_verbose=False)
             
         if args.perceptual_loss_weight:
             # Weights should be kept locally ~ 500 MB space
             with tf.variable_scope('vgg16'):
-                train_iFrames_features = vgg16.build_vgg16(
-                    train_iFrames,
+                iFrames_features = vgg16.build_vgg16(
+                    iFrames,
                     end_point=args.perceptual_loss_endpoint).features
             with tf.variable_scope('vgg16', reuse=tf.AUTO_REUSE):
-                train_rec_iFrames_features = vgg16.build_vgg16(
-                    train_rec_iFrames,
+                rec_iFrames_features = vgg16.build_vgg16(
+                    rec_iFrames,
                     end_point=args.perceptual_loss_endpoint).features
 
         print('Global parameters:{}'.format(
@@ -111,40 +137,38 @@ def training(args):
             count_parameters(tf.trainable_variables())))
 
         # DEFINE METRICS
+        # :loss is the validation loss when
+        # fed the validation handle. Padded examples
+        # of the final validation batch add no loss
+        loss_rec_iFrames = mask_padding(
+            rec_iFrames,
+            iFrames,
+            mask)
+
         if args.loss_id == 0:
-            train_loss = huber_loss(
-                train_iFrames, train_rec_iFrames,
-                delta=1.)
-            val_loss = huber_loss(
-                val_iFrames, val_rec_iFrames,
+            loss = huber_loss(
+                iFrames, loss_rec_iFrames,
                 delta=1.)
 
         elif args.loss_id == 1:
-            train_loss = tf_l2_loss(
-                train_iFrames, train_rec_iFrames)
-            val_loss = tf_l2_loss(
-                val_iFrames, val_rec_iFrames) 
+            loss = tf_l2_loss(
+                iFrames, loss_rec_iFrames)
 
         elif args.loss_id == 2:
-            train_loss = l1_loss(
-                train_iFrames, train_rec_iFrames)
-            val_loss = l1_loss(
-                val_iFrames, val_rec_iFrames)
+            loss = l1_loss(
+                iFrames, loss_rec_iFrames)
         
         elif args.loss_id == 3:
-            train_loss = ssim_loss(
-                train_rec_iFrames, train_iFrames)
-            val_loss = ssim_loss(
-                val_rec_iFrames, val_iFrames)
+            loss = ssim_loss(
+                loss_rec_iFrames, iFrames)
 
-        total_train_loss = train_loss
-        tf.summary.scalar('train_l2_loss', train_loss)
-        tf.summary.scalar('total_val_l2_loss', val_loss)
+        total_train_loss = loss
+        tf.summary.scalar('train_l2_loss', loss)
 
         if args.perceptual_loss_weight:
             train_perceptual_loss = tf_perceptual_loss(
-                train_iFrames_features,
-                train_rec_iFrames_features)
+                iFrames_features,
+                rec_iFrames_features)
 
             tf.summary.scalar('train_perceptual_loss',\
                 train_perceptual_loss)
@@ -172,7 +196,7 @@ def training(args):
 
         # DEFINE OPTIMIZER
         optimizer = get_optimizer(
-            train_loss,
+            loss,
             optim_id=args.optim_id,
             learning_rate=args.learning_rate,
             use_batch_norm=True)
@@ -180,44 +204,98 @@ def training(args):
         init_op = tf.group(
             tf.global_variables_initializer(),
             tf.local_variables_initializer())
-        saver = tf.train.Saver()
+        # retention is left to the manager
+        saver = tf.train.Saver(
+            max_to_keep=None)
+        checkpoints = CheckpointManager(
+            saver,
+            CKPT_PATH,
+            keep_best_k=args.keep_best_k,
+            keep_last_n=args.keep_last_n)
 
         sess.run(init_op)
 
-        coord = tf.train.Coordinator()
-        threads = tf.train.start_queue_runners(
-            coord=coord)
+        train_handle, val_handle = sess.run(
+            [train_handle, val_handle])
+        train_feed = {data_handle: train_handle, is_training: True}
+        val_feed = {data_handle: val_handle}
+
+        progress = ProgressLine(
+            args.train_iters,
+            interval=args.log_every_secs)
+        best_val_loss = float('inf')
 
         # START TRAINING HERE
         for iteration in range(args.train_iters):
-            _, t_summ, t_loss = sess.run(
-                [optimizer, merged, total_train_loss])
-
-            train_writer.add_summary(t_summ, iteration)
-            print('Iter:{}/{}, Train Loss:{}'.format(
+            # evaluate and write summaries only
+            # every :summary_every iterations
+            if iteration % args.summary_every == 0:
+                _, t_summ, t_loss = sess.run(
+                    [optimizer, merged, total_train_loss],
+                    feed_dict=train_feed)
+
+                train_writer.add_summary(t_summ, iteration)
+            else:
+                _, t_loss = sess.run(
+                    [optimizer, total_train_loss],
+                    feed_dict=train_feed)
+
+            progress.update(
                 iteration,
-                args.train_iters,
-                t_loss))
+                t_loss)
 
             if iteration % args.val_every == 0:
-                v_loss = sess.run(val_loss)
+                v_loss = batch_validation(
+                    sess,
+                    loss,
+                    mask,
+                    val_feed,
+                    args.batch_size)
                 print('Iter:{}, Val Loss:{}'.format(
                     iteration,
                     v_loss))
 
+                train_writer.add_summary(
+                    tf.Summary(value=[tf.Summary.Value(
+                        tag='total_val_l2_loss',
+                        simple_value=v_loss)]),
+                    iteration)
+
+            # the full validation set is only run for
+            # checkpoints, which are named by its mean loss
             if iteration % args.save_every == 0:
-                saver.save(
+                full_val_loss = full_validation(
                     sess,
-                    CKPT_PATH + 'iter:{}_val:{}'.format(
-                        str(iteration),
-                        str(round(v_loss, 3))))
+                    loss,
+                    val_feed,
+                    VAL_SAMPLES,
+                    args.batch_size)
+                best_val_loss = min(
+                    best_val_loss,
+                    full_val_loss)
+                print('Iter:{}, Full Val Loss:{}, Best Val Loss:{}'.format(
+                    iteration,
+                    full_val_loss,
+                    best_val_loss))
+
+                train_writer.add_summary(
+                    tf.Summary(value=[tf.Summary.Value(
+                        tag='full_total_val_l2_loss',
+                        simple_value=full_val_loss)]),
+                    iteration)
+
+                checkpoints.save(
+                    sess,
+                    iteration,
+                    full_val_loss)
 
             if iteration % args.plot_every == 0:
                 start_frames, end_frames, mid_frames,\
                     rec_mid_frames = sess.run(
-                        [train_fFrames, train_lFrames,\
-                            train_iFrames,\
-                            train_rec_iFrames])
+                        [fFrames, lFrames,\
+                            iFrames,\
+                            rec_iFrames],
+                        feed_dict=train_feed)
 
                 visualize_frames(
                     start_frames,
@@ -232,9 +310,10 @@ def training(args):
 
                 start_frames, end_frames, mid_frames,\
                     rec_mid_frames = sess.run(
-                        [val_fFrames, val_lFrames,\
-                            val_iFrames,
-                            val_rec_iFrames])
+                        [fFrames, lFrames,\
+                            iFrames,
+                            rec_iFrames],
+                        feed_dict=val_feed)
 
                 visualize_frames(
                     start_frames,
@@ -267,10 +346,36 @@ if __name__ == '__main__':
         help='Number of iterations after which validation is done')
 
     parser.add_argument(
-        '--save_every',
+        '--summary_every',
         type=int,
         default=100,
-        help='Number of iterations after which model is saved')
+        help='Number of iterations after which summaries are written')
+
+    parser.add_argument(
+        '--log_every_secs',
+        type=float,
+        default=10.,
+        help='Minimum seconds between training progress lines')
+
+    parser.add_argument(
+        '--save_every',
+        type=int,
+        default=1000,
+        help='Number of iterations after which the full\
+            validation set is run and the model is saved')
+
+    parser.add_argument(
+        '--keep_best_k',
+        type=int,
+        default=3,
+        help='Number of checkpoints with the lowest validation\
+            loss that are kept')
+
+    parser.add_argument(
+        '--keep_last_n',
+        type=int,
+        default=2,
+        help='Number of most recent checkpoints that are kept')
 
     parser.add_argument(
         '--plot_every',
@@ -368,6 +473,12 @@ if __name__ == '__main__':
         default=0,
         help='Specifies whether to use spatial/channel attention')
 
+    parser.add_argument(
+        '--shuffle_buffer_mb',
+        type=int,
+        default=256,
+        help='Memory budget in MB of the training shuffle buffer')
+
     args = parser.parse_args()
 
     if args.optimizer == 'adam': args.optim_id = 1
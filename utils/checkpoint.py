@@ -0,0 +1,145 @@
+import os
+import json
+
+import tensorflow as tf
+
+# written next to the checkpoints
+INDEX_NAME = 'checkpoints.json'
+META_GRAPH_NAME = 'model.meta'
+
+def load_checkpoint_index(model_path):
+    '''Loads the index written by :CheckpointManager
+    Args:
+        model_path: 'String' that points to the directory
+            holding checkpoints
+    Returns:
+        'Dict' with the 'best' checkpoint and the kept
+        'checkpoints', each a 'Dict' of step, val_loss and
+        path (relative to :model_path). None if there is
+        no index
+    '''
+    index_path = os.path.join(
+        model_path,
+        INDEX_NAME)
+
+    if not os.path.exists(index_path):
+        return None
+
+    with open(index_path, 'r') as handle:
+        return json.load(handle)
+
+
+class CheckpointManager(object):
+    '''Saves checkpoints and keeps only the :keep_best_k
+    with the lowest validation loss and the :keep_last_n
+    most recent ones. The meta graph is written once, and
+    a JSON index records the step, validation loss and
+    path of every kept checkpoint
+    Args:
+        saver: 'Saver' with max_to_keep=None, so that only
+            the manager deletes checkpoints
+        ckpt_path: 'String' directory of the checkpoints
+        keep_best_k: 'Integer' number of best checkpoints
+        keep_last_n: 'Integer' number of recent checkpoints
+    '''
+    def __init__(self, saver, ckpt_path, keep_best_k=3,
+                    keep_last_n=2):
+        assert keep_best_k >= 1,\
+            'the index needs the best checkpoint'
+
+        self.saver = saver
+        self.ckpt_path = ckpt_path
+        self.keep_best_k = keep_best_k
+        self.keep_last_n = keep_last_n
+        self.wrote_meta_graph = False
+
+        # checkpoints of an earlier run in the same
+        # directory are kept under the same policy
+        index = load_checkpoint_index(
+            ckpt_path)
+        self.checkpoints = index['checkpoints'] if index else []
+
+    def save(self, sess, step, val_loss):
+        '''Saves a checkpoint, removes the ones that fall
+        out of the policy and rewrites the index
+        Args:
+            sess: 'Session' that holds the model
+            step: 'Integer' training iteration
+            val_loss: 'Float' validation loss of the weights
+        Returns:
+            'String' prefix of the saved checkpoint
+        '''
+        if not self.wrote_meta_graph:
+            self.saver.export_meta_graph(
+                os.path.join(self.ckpt_path, META_GRAPH_NAME))
+            self.wrote_meta_graph = True
+
+        name = 'iter:{}_val:{}'.format(
+            str(step),
+            str(round(val_loss, 3)))
+        self.saver.save(
+            sess,
+            os.path.join(self.ckpt_path, name),
+            write_meta_graph=False,
+            write_state=False)
+
+        # a rerun may save to the path of an older entry
+        self.checkpoints = [
+            checkpoint
+            for checkpoint in self.checkpoints
+            if checkpoint['path'] != name]
+        self.checkpoints.append({
+            'step': step,
+            'val_loss': float(val_loss),
+            'path': name})
+        self.__apply_policy()
+        self.__write_index()
+
+        return os.path.join(
+            self.ckpt_path,
+            name)
+
+    def __apply_policy(self):
+        by_loss = sorted(
+            self.checkpoints,
+            key=lambda checkpoint: checkpoint['val_loss'])
+
+        last_n = self.checkpoints[-self.keep_last_n:]\
+            if self.keep_last_n else []
+        kept_paths = set(
+            checkpoint['path']
+            for checkpoint in by_loss[:self.keep_best_k] + last_n)
+
+        for checkpoint in self.checkpoints:
+            if checkpoint['path'] not in kept_paths\
+                and tf.train.checkpoint_exists(
+                    os.path.join(self.ckpt_path, checkpoint['path'])):
+                tf.train.remove_checkpoint(
+                    os.path.join(self.ckpt_path, checkpoint['path']))
+
+        self.checkpoints = [
+            checkpoint
+            for checkpoint in self.checkpoints
+            if checkpoint['path'] in kept_paths]
+
+    def __write_index(self):
+        index_path = os.path.join(
+            self.ckpt_path,
+            INDEX_NAME)
+
+        index = {
+            'best': min(
+                self.checkpoints,
+                key=lambda checkpoint: checkpoint['val_loss']),
+            'checkpoints': self.checkpoints}
+
+        # replace the index in one step, so that readers
+        # never see a partial file
+        with open(index_path + '.tmp', 'w') as handle:
+            json.dump(
+                index,
+                handle,
+                indent=2)
+        os.replace(
+            index_path + '.tmp',
+            index_path)
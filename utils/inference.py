@@ -0,0 +1,153 @@
+import os
+
+import tensorflow as tf
+
+from utils.checkpoint import load_checkpoint_index
+
+from models import wnet
+from models import slomo
+from models import BiPN
+
+# tensor names of exported graphs
+INPUT_NAMES = ['fFrames', 'lFrames']
+OUTPUT_NAME = 'rec_iFrames'
+
+def get_best_checkpoint(model_path):
+    '''Returns the checkpoint with the lowest validation
+    loss, read from the index of utils.checkpoint. Older
+    runs without an index are searched for the loss in
+    the names of their meta graphs (iter:<step>_val:<loss>)
+    Args:
+        model_path: 'String' that points to the directory
+            holding checkpoints
+    Returns:
+        'String' checkpoint prefix to restore
+    '''
+    index = load_checkpoint_index(
+        model_path)
+    if index is not None:
+        return os.path.join(
+            model_path,
+            index['best']['path'])
+
+    weight_paths = [
+        i[:-len('.meta')]
+        for i in os.listdir(model_path)
+        if i.endswith('.meta') and 'val:' in i]
+
+    di_weight = {}
+    for path in weight_paths:
+        di_weight[path] = float(path.split('val:')[-1])
+    weight_path = min(
+        di_weight,
+        key=di_weight.get)
+
+    return os.path.join(
+        model_path,
+        weight_path)
+
+
+def build_model(fFrames, lFrames, info, is_verbose=False):
+    '''Builds a model for inference under the same
+    variable scope it was trained in
+    Args:
+        fFrames: 'Tensor' of dtype tf.float32 containing
+            first frames in [-1, 1]
+        lFrames: 'Tensor' of dtype tf.float32 containing
+            last frames in [-1, 1]
+        info: 'Dict' with model_name ('wnet', 'slomo' or
+            'bipn'), n_IF, out_channels, attention and
+            use_spatial_attention
+        is_verbose: 'Bool' to print layer shapes
+    Returns:
+        'Tensor' of dtype tf.float32 containing the
+        interpolated frames [B, n_IF, H, W, 1]
+    '''
+    n_IF = info['n_IF']
+
+    # get attention
+    use_attention = int(bool(info['attention']))
+    spatial_attention = int(
+        bool(info['attention'] and info['use_spatial_attention']))
+
+    if info['model_name'] == 'wnet':
+        with tf.variable_scope('separate_bipn'):
+            rec_iFrames = wnet.build_wnet(
+                fFrames,
+                lFrames,
+                use_batch_norm=True,
+                is_training=False,
+                n_IF=n_IF,
+                starting_out_channels=info['out_channels'],
+                use_attention=use_attention,
+                spatial_attention=spatial_attention,
+                is_verbose=is_verbose)
+
+    elif info['model_name'] == 'slomo':
+        with tf.variable_scope('slomo'):
+            output = slomo.SloMo_model(
+                fFrames,
+                lFrames,
+                first_kernel=7,
+                second_kernel=5,
+                reuse=False,
+                t_steps=n_IF,
+                verbose=is_verbose)
+            rec_iFrames = output[0]
+
+    elif info['model_name'] == 'bipn':
+        with tf.variable_scope('bipn'):
+            rec_iFrames = BiPN.build_bipn(
+                fFrames,
+                lFrames,
+                n_IF=n_IF,
+                use_batch_norm=True,
+                is_training=False)
+
+    else:
+        raise ValueError(
+            'unknown model {}'.format(info['model_name']))
+
+    return rec_iFrames
+
+
+def to_uint8_frames(frames):
+    '''Maps frames in [-1, 1] back to pixels
+    Args:
+        frames: 'Tensor' of dtype tf.float32
+    Returns:
+        'Tensor' of dtype tf.uint8
+    '''
+    with tf.name_scope('denormalize'):
+        frames = (frames + 1.) * 127.5
+
+        return tf.cast(
+            tf.clip_by_value(frames, 0., 255.) + 0.5,
+            tf.uint8)
+
+
+def load_frozen_model(graph_path, fFrames, lFrames):
+    '''Imports a GraphDef written by export_model.py
+    with :fFrames and :lFrames as its inputs
+    Args:
+        graph_path: 'String' path of the GraphDef
+        fFrames: 'Tensor' of dtype tf.uint8 containing
+            first frames
+        lFrames: 'Tensor' of dtype tf.uint8 containing
+            last frames
+    Returns:
+        'Tensor' of dtype tf.uint8 containing the
+        interpolated frames [B, n_IF, H, W, 1]
+    '''
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(graph_path, 'rb') as handle:
+        graph_def.ParseFromString(
+            handle.read())
+
+    rec_iFrames, = tf.import_graph_def(
+        graph_def,
+        input_map=dict(zip(INPUT_NAMES, [fFrames, lFrames])),
+        return_elements=[OUTPUT_NAME + ':0'],
+        name='frozen')
+
+    return rec_iFrames
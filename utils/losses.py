@@ -144,3 +144,20 @@ def tf_perceptual_loss(predictions, ground_truth):
     '''
 
     return tf.nn.l2_loss(predictions - ground_truth)
+
+def mask_padding(prediction, ground_truth, mask):
+    '''Replaces the predictions of padded examples with
+    their ground truth, so that padding adds no loss
+    Args:
+        prediction: tensor of shape [N, N_IF, H, W, 1]
+        ground_truth: tensor of shape [N, N_IF, H, W, 1]
+        mask: tensor of shape [N], 1 for real examples
+            and 0 for padding
+    Returns:
+        tensor of shape [N, N_IF, H, W, 1]
+    '''
+    mask = tf.reshape(
+        mask,
+        [-1, 1, 1, 1, 1])
+
+    return mask * prediction + (1. - mask) * ground_truth
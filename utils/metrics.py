@@ -44,24 +44,20 @@ def metric_repeat_lframe(lframes, mid_frames):
 
 
 
-def metric_weighted_frame(fframes,mid_frames,lframes):
+def get_weighted_frames(fframes, lframes, inter_frames):
 	'''
-	Do a weighted interpolation between first frame 
-	and the last. Then take their difference between 
-	the weighted sum and the true intermediate frames
+	Weighted interpolation between first frame
+	and the last for every intermediate frame
 
 	Args:
 		fframes: tensor, [B,H,W,1]
-		mid_frames: tensor, [B,inter_frames,H,W,1]
 		lframes: tensor, [B,H,W,1]
+		inter_frames: int, number of intermediate frames
 
 	Output:
-		l2 loss between weighted images and ground truth
+		tensor, [B,inter_frames,H,W,1]
 	'''
 
-	inter_frames = mid_frames.get_shape()[1]
-
-
 	fframes_expanded = tf.expand_dims(fframes,axis=1)
 	lframes_expanded = tf.expand_dims(lframes,axis=1)
 
@@ -76,9 +72,30 @@ def metric_weighted_frame(fframes,mid_frames,lframes):
 		[1,inter_frames,1,1,1])/tf.cast(
 		(inter_frames+1),dtype=tf.float32)
 
-	weighted_sum = (fframes_tiled * weighting + 
+	return (fframes_tiled * weighting + 
 		lframes_tiled *(1-weighting))
 
+
+def metric_weighted_frame(fframes,mid_frames,lframes):
+	'''
+	Do a weighted interpolation between first frame 
+	and the last. Then take their difference between 
+	the weighted sum and the true intermediate frames
+
+	Args:
+		fframes: tensor, [B,H,W,1]
+		mid_frames: tensor, [B,inter_frames,H,W,1]
+		lframes: tensor, [B,H,W,1]
+
+	Output:
+		l2 loss between weighted images and ground truth
+	'''
+
+	inter_frames = mid_frames.get_shape()[1]
+
+	weighted_sum = get_weighted_frames(fframes,
+		lframes, inter_frames)
+
 	return [l2_loss(mid_frames,weighted_sum),\
 			compute_psnr(mid_frames,weighted_sum)]
 
@@ -115,11 +132,127 @@ def compute_psnr(ref, target):
 		PSNR between predicion and ground truth
 	'''
 
-    diff = target - ref
-    sqr = tf.multiply(diff, diff)
-    err = tf.reduce_sum(sqr)
-    v = tf.reduce_prod(diff.get_shape())
-    mse = err / tf.cast(v, tf.float32) + 1e-12
-    psnr = 10. * (tf.log(255. * 255. / mse) / tf.log(10.))
+	diff = target - ref
+	sqr = tf.multiply(diff, diff)
+	err = tf.reduce_sum(sqr)
+	# tf.size also works when the batch size is dynamic
+	v = tf.size(diff)
+	mse = err / tf.cast(v, tf.float32) + 1e-12
+	psnr = 10. * (tf.log(255. * 255. / mse) / tf.log(10.))
+
+	return psnr
+
+
+def mse_to_psnr(mse):
+	'''
+	Converts mean squared error to PSNR with the
+	same peak as compute_psnr
+
+	Args:
+		mse: tensor of mean squared errors
+
+	Output:
+		PSNR of the same shape as mse
+	'''
+
+	return 10. * (tf.log(255. * 255. / (mse + 1e-12))
+		/ tf.log(tf.constant(10., dtype=mse.dtype)))
+
+
+def streaming_frame_metric(mid_frames, pred_frames, name):
+	'''
+	Accumulates the squared error and pixel count of
+	every intermediate frame index across batches, like
+	tf.metrics. Values are exact over all samples seen
+	since local variables were initialized
+
+	Args:
+		mid_frames: tensor, [B,inter_frames,H,W,1]
+		pred_frames: tensor, broadcastable to mid_frames
+		name: string, variable scope of the accumulators
+
+	Output:
+		values: dict of 'mse', 'psnr' (global scalars)
+			and 'frame_mse', 'frame_psnr' ([inter_frames])
+		update_op: op that adds the batch to the totals
+	'''
+
+	inter_frames = mid_frames.get_shape().as_list()[1]
+
+	with tf.variable_scope(name):
+		# float64 keeps the sums exact over a full test set
+		sse = tf.Variable(
+			tf.zeros([inter_frames], dtype=tf.float64),
+			trainable=False,
+			collections=[tf.GraphKeys.LOCAL_VARIABLES,
+				tf.GraphKeys.METRIC_VARIABLES],
+			name='sum_squared_error')
+		count = tf.Variable(
+			tf.zeros([inter_frames], dtype=tf.float64),
+			trainable=False,
+			collections=[tf.GraphKeys.LOCAL_VARIABLES,
+				tf.GraphKeys.METRIC_VARIABLES],
+			name='pixel_count')
+
+		diff = tf.cast(mid_frames - pred_frames, tf.float64)
+		batch_sse = tf.reduce_sum(tf.square(diff),
+			axis=[0,2,3,4])
+		batch_count = tf.cast(
+			tf.size(diff) // inter_frames, tf.float64)
+
+		update_op = tf.group(
+			tf.assign_add(sse, batch_sse),
+			tf.assign_add(count,
+				tf.fill([inter_frames], batch_count)))
+
+		frame_mse = sse / tf.maximum(count, 1.)
+		mse = tf.reduce_sum(sse) / tf.maximum(
+			tf.reduce_sum(count), 1.)
+
+	values = {
+		'mse': mse,
+		'psnr': mse_to_psnr(mse),
+		'frame_mse': frame_mse,
+		'frame_psnr': mse_to_psnr(frame_mse)}
+
+	return values, update_op
+
+
+def streaming_metrics(fframes, mid_frames, lframes,
+	rec_mid_frames):
+	'''
+	Streaming versions of the repeat first, repeat last,
+	weighted and interpolated frame metrics
+
+	Args:
+		fframes: tensor, [B,H,W,1]
+		mid_frames: tensor, [B,inter_frames,H,W,1]
+		lframes: tensor, [B,H,W,1]
+		rec_mid_frames: tensor, [B,inter_frames,H,W,1]
+
+	Output:
+		values: dict of metric name to the values of
+			streaming_frame_metric
+		update_op: single op that updates every metric
+	'''
+
+	inter_frames = mid_frames.get_shape()[1]
 
-    return psnr
+	predictions = {
+		'repeat_first': tf.expand_dims(fframes,axis=1),
+		'repeat_last': tf.expand_dims(lframes,axis=1),
+		'weighted_frames': get_weighted_frames(fframes,
+			lframes, inter_frames),
+		'inter_frames': rec_mid_frames}
+
+	values = {}
+	update_ops = []
+	with tf.variable_scope('streaming_metrics'):
+		for metric_name, pred_frames in predictions.items():
+			values[metric_name], update_op = streaming_frame_metric(
+				mid_frames,
+				pred_frames,
+				metric_name)
+			update_ops.append(update_op)
+
+	return values, tf.group(*update_ops)
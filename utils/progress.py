@@ -0,0 +1,43 @@
+import time
+
+class ProgressLine(object):
+    '''Prints the mean training loss at most once every
+    :interval seconds instead of once per iteration
+    Args:
+        train_iters: 'Integer' total number of iterations
+        interval: 'Float' minimum seconds between lines
+    '''
+    def __init__(self, train_iters, interval=10.):
+        self.train_iters = train_iters
+        self.interval = interval
+        self.__reset(
+            time.time())
+
+    def __reset(self, now):
+        self.last_time = now
+        self.loss_sum = 0.
+        self.n_iters = 0
+
+    def update(self, iteration, loss):
+        '''Adds the loss of an iteration and prints the
+        running mean if :interval seconds have passed
+        Args:
+            iteration: 'Integer' current iteration
+            loss: 'Float' training loss of the iteration
+        '''
+        self.loss_sum += loss
+        self.n_iters += 1
+
+        now = time.time()
+        elapsed = now - self.last_time
+        if elapsed < self.interval\
+            and iteration < self.train_iters - 1:
+            return
+
+        print('Iter:{}/{}, Train Loss:{}, {} iters/second'.format(
+            iteration,
+            self.train_iters,
+            self.loss_sum / self.n_iters,
+            round(self.n_iters / max(elapsed, 1e-12), 2)))
+
+        self.__reset(now)
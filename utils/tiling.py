@@ -0,0 +1,106 @@
+import numpy as np
+
+def get_tile_origins(length, tile_size, overlap):
+    '''Returns the start of every tile along one axis.
+    Tiles are :tile_size - :overlap apart and the last
+    one is aligned to the end of the axis
+    Args:
+        length: 'Integer' size of the axis
+        tile_size: 'Integer' size of a tile
+        overlap: 'Integer' pixels shared by neighbouring
+            tiles
+    Returns:
+        'List' of 'Integer' tile starts
+    '''
+    assert length >= tile_size,\
+        'frame is smaller than the tile size {}'.format(tile_size)
+    assert 0 <= overlap < tile_size,\
+        'overlap should be in [0, {})'.format(tile_size)
+
+    stride = tile_size - overlap
+    origins = list(range(0, length - tile_size, stride))
+
+    return origins + [length - tile_size]
+
+
+def get_tiles(frame, tile_size=(100, 100), overlap=(20, 20)):
+    '''Cuts a frame into overlapping tiles
+    Args:
+        frame: 'Numpy' matrix of shape [height, width]
+        tile_size: 'Tuple' (height, width) of a tile
+        overlap: 'Tuple' (height, width) of the overlap
+    Returns:
+        tiles: 'Numpy' matrix of shape
+            [n_tiles, tile_height, tile_width]
+        origins: 'List' of (top, left) of every tile
+    '''
+    origins = [
+        (top, left)
+        for top in get_tile_origins(
+            frame.shape[0], tile_size[0], overlap[0])
+        for left in get_tile_origins(
+            frame.shape[1], tile_size[1], overlap[1])]
+
+    tiles = np.stack([
+        frame[top: top + tile_size[0], left: left + tile_size[1]]
+        for top, left in origins])
+
+    return tiles, origins
+
+
+def get_feather_weights(tile_size=(100, 100), overlap=(20, 20)):
+    '''Returns blending weights that ramp linearly from
+    the tile border over the overlap, so seams fade into
+    the neighbouring tile
+    Args:
+        tile_size: 'Tuple' (height, width) of a tile
+        overlap: 'Tuple' (height, width) of the overlap
+    Returns:
+        'Numpy' matrix of dtype np.float32 and shape
+        [tile_height, tile_width]
+    '''
+    ramps = []
+    for size, ramp_size in zip(tile_size, overlap):
+        # distance to the nearest border, in (0, 1]
+        distance = np.minimum(
+            np.arange(size) + 1,
+            np.arange(size)[::-1] + 1)
+        ramps.append(
+            np.minimum(distance / (ramp_size + 1.), 1.))
+
+    return np.outer(
+        ramps[0],
+        ramps[1]).astype(np.float32)
+
+
+def stitch_tiles(tiles, origins, frame_shape, weights):
+    '''Blends tiles back into a frame with a weighted
+    average over the overlaps
+    Args:
+        tiles: 'Numpy' matrix of shape
+            [n_tiles, ..., tile_height, tile_width]
+        origins: 'List' of (top, left) of every tile
+        frame_shape: 'Tuple' (height, width) of the frame
+        weights: 'Numpy' matrix of shape
+            [tile_height, tile_width]
+    Returns:
+        'Numpy' matrix of dtype np.float32 and shape
+        [..., height, width]
+    '''
+    tile_height, tile_width = weights.shape
+    lead_shape = tiles.shape[1:-2]
+
+    frame = np.zeros(
+        lead_shape + tuple(frame_shape),
+        dtype=np.float32)
+    total_weight = np.zeros(
+        frame_shape,
+        dtype=np.float32)
+
+    for tile, (top, left) in zip(tiles, origins):
+        frame[..., top: top + tile_height, left: left + tile_width] +=\
+            tile * weights
+        total_weight[top: top + tile_height, left: left + tile_width] +=\
+            weights
+
+    return frame / total_weight
@@ -0,0 +1,51 @@
+def full_validation(sess, loss, feed_dict, n_samples, batch_size):
+    '''Evaluates :loss over the whole validation set.
+    The validation dataset should be cached, with its
+    final batch padded and masked out of :loss (see
+    utils.losses.mask_padding). It repeats with a period
+    of one pass, so any ceil(:n_samples / :batch_size)
+    consecutive batches cover every sample exactly once
+    Args:
+        sess: 'Session' that holds the model
+        loss: 'Tensor' scalar loss of one batch, a mean or
+            a sum over its samples
+        feed_dict: 'Dict' that selects the validation data
+        n_samples: 'Integer' number of validation samples
+        batch_size: 'Integer' number of samples per batch
+    Returns:
+        'Float' loss over all samples, on the scale of the
+        loss of one full batch
+    '''
+    n_batches = -(-n_samples // batch_size)
+
+    loss_sum = 0.
+    for _ in range(n_batches):
+        loss_sum += sess.run(
+            loss,
+            feed_dict=feed_dict)
+
+    # padding adds nothing to a batch, so the sum
+    # is rescaled by the real samples only
+    return loss_sum * batch_size / n_samples
+
+
+def batch_validation(sess, loss, mask, feed_dict, batch_size):
+    '''Evaluates :loss on the next validation batch, a
+    cheap and noisy check between full validations
+    Args:
+        sess: 'Session' that holds the model
+        loss: 'Tensor' scalar loss of one batch, with the
+            padding masked out
+        mask: 'Tensor' of shape [batch_size], 1 for real
+            examples and 0 for padding
+        feed_dict: 'Dict' that selects the validation data
+        batch_size: 'Integer' number of samples per batch
+    Returns:
+        'Float' loss of the batch, rescaled as if it were
+        full when it is the padded final batch
+    '''
+    batch_loss, batch_mask = sess.run(
+        [loss, mask],
+        feed_dict=feed_dict)
+
+    return batch_loss * batch_size / batch_mask.sum()
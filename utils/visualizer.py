@@ -1,16 +1,35 @@
 import tensorflow as tf
 
 import os
-import matplotlib.pyplot as plt
+import cv2
 import numpy as np
 
+def to_uint8_tile(image, v_min, v_max):
+    '''Scales a frame to [0, 255] with the given
+    display range, like imshow(vmin, vmax)
+    Args
+        image: (... X height X width)
+        v_min: lower end of the display range
+        v_max: upper end of the display range
+    return:
+        uint8 array of the same shape as image
+    '''
+    scale = 255. / max(v_max - v_min, 1e-12)
+
+    return np.clip(
+        (image - v_min) * scale,
+        0,
+        255).astype(np.uint8)
+
+
 def visualize_frames(start_frames, end_frames,
                     mid_frames, rec_mid_frames,
                     iteration=100, save_path='',
                     training=False,
-                    num_plots=3):
+                    num_plots=3, gap=2):
     '''Helper function to plot interpolated results
-    and save plots to local disk
+    and save plots to local disk. All frames are tiled
+    into one uint8 mosaic that is written with cv2
     Args
     	start_frames: (batch_size X height X width X 1 )
     	end_frames: (batch_size X height X width X 1)
@@ -23,109 +42,57 @@ def visualize_frames(start_frames, end_frames,
         iteration: current train or validation iteration
         training : plot train or valid frames
         num_plots: number of samples to plot
+        gap: pixels of white space between tiles
     '''
     num_samples = np.minimum(
         num_plots,
         mid_frames.shape[0])
-    
+
+    height, width = start_frames.shape[1:3]
     # num samples * 2 because of the true images
     num_rows = 2 * num_samples 
     # start+ end + num_midframes
     num_cols = 2 + mid_frames.shape[1]
 
-    # selected_samples = np.random.choice(
-    #     mid_frames.shape[0],
-    #     num_samples,
-    #     replace = False) # array of shuffled indicies
-
-    selected_samples = np.arange(num_samples)
-
-    # subsample the batch for plotting
-
-    # num_samples X 100 X 100
-    start_images = start_frames[selected_samples,:,:,0] 
-    #num_samples X 100 X 100
-    end_images = end_frames[selected_samples,:,:,0]
-    #num_samples X 3 X 100 X 100
-    gen_mid_images = rec_mid_frames[selected_samples,:,:,:,0]
-    #num_samples X 3 X 100 X 100
-    true_mid_images = mid_frames[selected_samples,:,:,:,0] 
-
-    fig, axes = plt.subplots(
-        nrows=num_rows,
-        ncols=num_cols,
-        figsize=(10,10))
-
-
-    for row in range (num_rows):
-
-        col = 0
-        even_row = row % 2
-        idx = row // 2
-
-        axes[row, col].axis("off")
-        
-        
-        if even_row:
-        	# row 1, 3 ... don't show start and end frames
-            axes[row,col].text(.5,.5,'Generated')
-            axes[row, num_cols-1].axis("off")
-            axes[row,num_cols-1].text(0,.5,'Frames')
-        else:
-            # update the scale for imshow
-            v_min = np.min(start_images[idx])
-            v_min = np.min([np.min(end_images[idx]),v_min])
-            v_min = np.min([np.min(true_mid_images[idx]),v_min])
-            # v_min = np.min([np.min(gen_mid_images[idx]),v_min])
-
-            v_max = np.max(start_images[idx])
-            v_max = np.max([np.max(end_images[idx]),v_max])
-            v_max = np.max([np.max(true_mid_images[idx]),v_max])
-            # v_max = np.max([np.max(gen_mid_images[idx]),v_max])
-                # row 0, 2 ... show start and end frames 
-            axes[row, col].imshow(
-                start_images[idx],
-                cmap="gray",
-                vmin=v_min,
-                vmax=v_max,
-                aspect="auto")
-            axes[row, num_cols-1].axis("off")
-            axes[row, num_cols-1].imshow(
-                end_images[idx],
-                cmap="gray",
-                vmin=v_min,
-                vmax=v_max,
-                aspect="auto")
-
-            
-        for col in range (1,num_cols-1):
-            axes[row, col].axis("off")
-            if even_row:
-            	# row 1, 3 ... show generated frames
-                axes[row, col].imshow(
-                    gen_mid_images[idx,col-1],
-                    cmap="gray",
-                    vmin=v_min,
-                    vmax=v_max,
-                    aspect="auto")
-
-            else:
-            	# row 0, 2 ... show true frames
-                axes[row, col].imshow(
-                    true_mid_images[idx,col-1],
-                    cmap="gray",
-                    vmin=v_min,
-                    vmax=v_max,
-                    aspect="auto")
-                
-
-    plt.draw()
-
-
-    plt.subplots_adjust(
-        wspace=.02,
-        hspace=.05)
-
+    mosaic = np.full(
+        (num_rows * (height + gap) - gap,
+            num_cols * (width + gap) - gap),
+        255,
+        dtype=np.uint8)
+
+    def __put(row, col, tile):
+        top = row * (height + gap)
+        left = col * (width + gap)
+        mosaic[top: top + height, left: left + width] = tile
+
+    for idx in range(num_samples):
+        start_image = start_frames[idx, :, :, 0]
+        end_image = end_frames[idx, :, :, 0]
+        true_mid_images = mid_frames[idx, :, :, :, 0]
+        gen_mid_images = rec_mid_frames[idx, :, :, :, 0]
+
+        # one display range per sample, from the true
+        # frames only, so both rows are comparable
+        v_min = min(
+            start_image.min(),
+            end_image.min(),
+            true_mid_images.min())
+        v_max = max(
+            start_image.max(),
+            end_image.max(),
+            true_mid_images.max())
+
+        # row 0, 2 ... start, true and end frames
+        __put(2 * idx, 0, to_uint8_tile(start_image, v_min, v_max))
+        __put(2 * idx, num_cols - 1, to_uint8_tile(end_image, v_min, v_max))
+        for col, tile in enumerate(
+            to_uint8_tile(true_mid_images, v_min, v_max)):
+            __put(2 * idx, col + 1, tile)
+
+        # row 1, 3 ... generated frames only
+        for col, tile in enumerate(
+            to_uint8_tile(gen_mid_images, v_min, v_max)):
+            __put(2 * idx + 1, col + 1, tile)
 
     filename = ['validation','training'][training]\
         +'_iteration_'\
@@ -134,7 +101,9 @@ def visualize_frames(start_frames, end_frames,
     if not os.path.exists(save_path):
         os.makedirs(save_path)
 
-    plt.savefig(save_path + filename)
+    cv2.imwrite(
+        save_path + filename,
+        mosaic)
 
     return
 